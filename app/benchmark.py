@@ -0,0 +1,382 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import itertools
+import subprocess
+import tracemalloc
+from corpus import load_posts
+
+# Fixed query set shared by the query benchmarks
+QUERIES = [
+    "space shuttle launch", "clipper chip encryption", "floppy drive controller",
+    "gun control legislation", "hockey playoff goalie", "motorcycle helmet",
+    "doctor pain medication", "window manager x11", "mac monitor display",
+    "car engine oil", "baseball pitcher era", "graphics image format jpeg",
+    "christian faith bible", "power supply circuit voltage", "for sale used computer",
+    "orbit moon nasa funding", "ide scsi hard disk", "atheism religion morality",
+]
+
+# Cold-start import budget in seconds for `startup`; GUI start should stay under it
+STARTUP_BUDGET = float(os.environ.get("FETCHER_STARTUP_BUDGET", 1.0))
+
+# Query latency percentiles reported by `suite`
+PERCENTILES = (50, 95, 99)
+
+# Differences below these are noise and never count as regressions, by metric unit
+NOISE_FLOOR = {"_s": 0.005, "_ms": 0.05, "_mib": 0.5}
+
+def docs_per_sec(fn, texts: list[str]) -> float:
+    start = time.perf_counter()
+    fn(texts)
+    return len(texts) / (time.perf_counter() - start)
+
+def bench_preprocess(path: str, n_docs: int, batch_size: int, n_process: int):
+    '''
+    Lemmatization throughput in docs/sec: the original per-document call
+    through the full pipeline against batched `nlp.pipe` on the trimmed one
+    '''
+    import spacy
+    from preprocessing import regex_text, lemma, preprocess_batch, lemma_cache
+
+    posts = load_posts(path)
+    texts = list(itertools.islice(posts.values(), n_docs))
+
+    full_model = spacy.load("en_core_web_sm")
+    single = docs_per_sec(lambda batch: [lemma(regex_text(text), full_model) for text in batch], texts)
+    batched = docs_per_sec(lambda batch: preprocess_batch(batch, False, batch_size=batch_size,
+                                                          n_process=n_process), texts)
+
+    print(f"Preprocessing {len(texts)} posts")
+    print(f"  full pipeline, one call per doc: {single:10.1f} docs/sec")
+    print(f"  nlp.pipe (batch={batch_size}, n_process={n_process}): {batched:10.1f} docs/sec")
+    print(f"  speed-up: {batched / single:.2f}x")
+    print(f"  lemma cache: {lemma_cache.stats()}")
+
+def bench_index_memory(path: str):
+    '''
+    Memory held by the old dict/set inverted indexes against `InvertedIndex`
+    '''
+    from collections import Counter, defaultdict
+    from corpus import Corpus
+    from inverted_index import InvertedIndex, deep_sizeof
+
+    corpus = Corpus(path)
+    term_counts = {doc: Counter(tokens) for doc, tokens in corpus.tokens.items()}
+
+    boolean_sets = defaultdict(set)
+    bm25_dicts = {}
+    for doc, counts in term_counts.items():
+        for term, freq in counts.items():
+            boolean_sets[term].add(doc)
+            bm25_dicts.setdefault(term, {})[doc] = freq
+
+    index = InvertedIndex(term_counts)
+    plain = index.memory_usage()
+    index.compress()
+    compressed = index.memory_usage()
+
+    mib = 1 << 20
+    print(f"Inverted index over {len(corpus)} posts, {len(index)} terms")
+    print(f"  BooleanIR defaultdict(set):     {deep_sizeof(boolean_sets) / mib:8.1f} MiB")
+    print(f"  BM25 dict of dicts:             {deep_sizeof(bm25_dicts) / mib:8.1f} MiB")
+    print(f"  InvertedIndex (shared by both): {plain / mib:8.1f} MiB")
+    print(f"  InvertedIndex, delta+varint:    {compressed / mib:8.1f} MiB")
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def bench_pruning(path: str, k: int):
+    '''
+    Postings visited and latency of MaxScore and impact ordering against exhaustive scoring
+    '''
+    import tfidf_fn as idf_fns
+    from preprocessing import preprocess
+    from retrieval_models import build_models
+
+    models = build_models(path)
+    bm25, vsm = models["bm25"], models["vsm"]
+    index = bm25.inverted_index
+
+    # Warm the per-(k1, b) caches so they are not billed to the first query
+    bm25.term_upper_bounds()
+    bm25.build_impact_index()
+    vsm.return_top_n(QUERIES[0], k, pruning="maxscore")
+
+    totals = {name: [0, 0.0] for name in ("bm25", "bm25-maxscore", "bm25-impact", "vsm", "vsm-maxscore")}
+    for query in QUERIES:
+        terms = set(preprocess(query))
+        _, ms = timed(bm25.compute_bm25, query, top_n=k)
+        totals["bm25"][0] += sum(index.doc_freq(term) for term in terms)
+        totals["bm25"][1] += ms
+
+        _, ms = timed(bm25.compute_bm25, query, top_n=k, pruning="maxscore")
+        totals["bm25-maxscore"][0] += bm25.last_postings_visited
+        totals["bm25-maxscore"][1] += ms
+
+        _, ms = timed(bm25.compute_bm25, query, top_n=k, pruning="impact")
+        totals["bm25-impact"][0] += bm25.last_postings_visited
+        totals["bm25-impact"][1] += ms
+
+        tfidf_query = idf_fns.sklearn_tfidif_query(query, vsm.custom_vectorizer)
+        _, ms = timed(vsm.return_top_n, query, k)
+        totals["vsm"][0] += sum(int(vsm._column_index().indptr[t + 1] - vsm._column_index().indptr[t])
+                                for t in tfidf_query.indices)
+        totals["vsm"][1] += ms
+
+        _, ms = timed(vsm.return_top_n, query, k, pruning="maxscore")
+        totals["vsm-maxscore"][0] += vsm.last_postings_visited
+        totals["vsm-maxscore"][1] += ms
+
+    print(f"{len(QUERIES)} queries, top {k}, {index.num_docs} posts")
+    for name, (visited, ms) in totals.items():
+        print(f"  {name:14s} postings visited: {visited:9d}   mean latency: {ms / len(QUERIES):8.2f} ms")
+
+def import_times(module: str) -> list[tuple[str, int, float, float]]:
+    '''
+    (module, nesting depth, self seconds, cumulative seconds) for every module
+    loaded by `import module` in a fresh interpreter, from `-X importtime`
+    '''
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise ValueError(f"Importing '{module}' failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        times.append((name.strip(), depth, int(self_us) / 1e6, int(cumulative_us) / 1e6))
+    return times
+
+def bench_startup(module: str, budget: float, top: int) -> bool:
+    '''
+    Cold import time of `module` against `budget` seconds, with the slowest
+    modules by cumulative time. Returns whether it is within budget.
+    '''
+    times = import_times(module)
+    total = sum(cumulative for _, depth, _, cumulative in times if depth == 0)
+
+    print(f"import {module}: {total:.3f}s of imports, {len(times)} modules, budget {budget:.3f}s")
+    print(f"  {'cumulative':>10s} {'self':>8s}  module")
+    for name, depth, own, cumulative in sorted(times, key=lambda t: -t[3])[:top]:
+        print(f"  {cumulative:9.3f}s {own:7.3f}s  {'  ' * depth}{name}")
+
+    if total > budget:
+        print(f"  OVER BUDGET by {total - budget:.3f}s")
+    return total <= budget
+
+def measure(fn, trace_memory: bool = True):
+    '''
+    (result, {"time_s", "peak_mib"}) of one call. Peak memory is what
+    tracemalloc saw allocated during the call, so it adds some overhead
+    to the time; with `trace_memory=False` only the time is recorded.
+    '''
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    stats = {"time_s": time.perf_counter() - start}
+
+    if trace_memory:
+        stats["peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, stats
+
+def scaled_posts(posts: dict[str, str], scale: int) -> dict[str, str]:
+    '''
+    `scale` copies of every post; copies after the first are renamed `name~i`
+    '''
+    return {name if copy == 0 else f"{name}~{copy}": text
+            for copy in range(scale) for name, text in posts.items()}
+
+def latency_stats(latencies_ms: list[float]) -> dict[str, float]:
+    import numpy as np
+
+    stats = {f"p{p}_ms": float(np.percentile(latencies_ms, p)) for p in PERCENTILES}
+    stats["mean_ms"] = float(np.mean(latencies_ms))
+    return stats
+
+def bench_scale(path: str, scale: int, analyzer: str, k: int, repeats: int, trace_memory: bool) -> dict:
+    '''
+    Stage timings and peak memory for one corpus size, then query latency
+    of every model over `QUERIES`
+    '''
+    from corpus import Corpus
+    from preprocessing import preprocess_batch, warm_up, lemma_cache, stem_tables
+    from retrieval_models import VectorSpaceModel, BooleanIR, BM25
+
+    # Model loading is a one-off cost, kept out of the preprocessing figure;
+    # token caches start empty so every run preprocesses from scratch
+    warm_up(analyzer)
+    lemma_cache.clear()
+    for table in stem_tables.values():
+        table.clear()
+
+    stages = {}
+    posts, stages["load"] = measure(lambda: scaled_posts(load_posts(path), scale), trace_memory)
+    token_lists, stages["preprocess"] = measure(
+        lambda: preprocess_batch(list(posts.values()), analyzer=analyzer), trace_memory)
+    corpus = Corpus.from_tokens(path, posts, token_lists, analyzer=analyzer)
+
+    # Each model builds its own index over the shared corpus, as when used alone
+    models = {}
+    models["vsm"], stages["vsm_build"] = measure(lambda: VectorSpaceModel(corpus=corpus), trace_memory)
+    models["bool"], stages["bool_build"] = measure(lambda: BooleanIR(corpus=corpus), trace_memory)
+    models["bm25"], stages["bm25_build"] = measure(lambda: BM25(corpus=corpus), trace_memory)
+
+    searches = {"vsm": lambda query: models["vsm"].return_top_n(query, k),
+                "bool": lambda query: models["bool"].query(query),
+                "bm25": lambda query: models["bm25"].compute_bm25(query, top_n=k)}
+    latency = {}
+    for name, search in searches.items():
+        for query in QUERIES:
+            search(query)
+
+        latencies = []
+        for _ in range(repeats):
+            for query in QUERIES:
+                _, ms = timed(search, query)
+                latencies.append(ms)
+        latency[name] = latency_stats(latencies)
+
+    return {"scale": scale, "docs": len(corpus), "tokens": sum(map(len, token_lists)),
+            "stages": stages, "latency": latency}
+
+def flatten(results: dict) -> dict[str, float]:
+    '''
+    Every measurement of a `suite` run as {"scale=1/stages/load/time_s": value}
+    '''
+    metrics = {}
+    for run in results["runs"]:
+        for group in ("stages", "latency"):
+            for name, stats in run[group].items():
+                for unit, value in stats.items():
+                    metrics[f"scale={run['scale']}/{group}/{name}/{unit}"] = value
+    return metrics
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    '''
+    Metrics of `current` more than `tolerance` (a fraction) worse than in
+    `baseline`, ignoring differences under the metric's noise floor
+    '''
+    before, after = flatten(baseline), flatten(current)
+    regressions = []
+
+    for metric in sorted(before.keys() & after.keys()):
+        old, new = before[metric], after[metric]
+        floor = next((value for suffix, value in NOISE_FLOOR.items() if metric.endswith(suffix)), 0.0)
+        if new - old > max(old * tolerance, floor):
+            regressions.append(f"{metric}: {old:.3f} -> {new:.3f} (+{(new - old) / old:.0%})" if old
+                               else f"{metric}: {old:.3f} -> {new:.3f}")
+    return regressions
+
+def report_comparison(baseline_path: str, current: dict, tolerance: float) -> bool:
+    with open(baseline_path, 'r', encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = compare(baseline, current, tolerance)
+    print(f"Against {baseline_path} (tolerance {tolerance:.0%}): {len(regressions)} regressions")
+
+    # Timings taken under tracemalloc or another analyzer are not comparable
+    differing = [key for key in ("path", "analyzer", "k", "repeats", "queries", "trace_memory")
+                 if baseline["meta"].get(key) != current["meta"].get(key)]
+    if differing:
+        print(f"  warning: the runs differ in {', '.join(differing)}")
+    for regression in regressions:
+        print(f"  {regression}")
+    return not regressions
+
+def bench_suite(path: str, scales: list[int], analyzer: str, k: int, repeats: int,
+                trace_memory: bool) -> dict:
+    '''
+    Load, preprocess and per-model build cost plus query latency percentiles,
+    at every corpus scale
+    '''
+    from preprocessing import ANALYZER
+
+    analyzer = analyzer or ANALYZER
+    results = {
+        "meta": {"path": path, "analyzer": analyzer, "k": k, "repeats": repeats,
+                 "queries": len(QUERIES), "trace_memory": trace_memory,
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "runs": [],
+    }
+
+    for scale in scales:
+        run = bench_scale(path, scale, analyzer, k, repeats, trace_memory)
+        results["runs"].append(run)
+
+        print(f"Scale x{scale}: {run['docs']} posts, {run['tokens']} tokens")
+        for name, stats in run["stages"].items():
+            memory = f"   peak {stats['peak_mib']:8.1f} MiB" if "peak_mib" in stats else ""
+            print(f"  {name:12s} {stats['time_s']:8.2f} s{memory}")
+        for name, stats in run["latency"].items():
+            print(f"  {name:12s} " + "  ".join(f"{unit[:-3]} {value:7.2f} ms" for unit, value in stats.items()))
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetcher benchmarks")
+    parser.add_argument("--path", default="data/*.txt", help="glob of the corpus files")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="lemmatization throughput")
+    preprocess_parser.add_argument("--docs", type=int, default=1000)
+    preprocess_parser.add_argument("--batch-size", type=int, default=64)
+    preprocess_parser.add_argument("--n-process", type=int, default=1)
+
+    subparsers.add_parser("index-memory", help="inverted index memory footprint")
+
+    pruning_parser = subparsers.add_parser("pruning", help="MaxScore and impact ordering against exhaustive top-k")
+    pruning_parser.add_argument("--k", type=int, default=10)
+
+    startup_parser = subparsers.add_parser("startup", help="cold-start import time against a budget")
+    startup_parser.add_argument("--module", default="main", help="module whose import is timed")
+    startup_parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="seconds")
+    startup_parser.add_argument("--top", type=int, default=15, help="slowest modules listed")
+
+    suite_parser = subparsers.add_parser("suite", help="build cost and query latency of every model")
+    suite_parser.add_argument("--scales", type=int, nargs="+", default=[1],
+                              help="corpus sizes to run, as multiples of the corpus")
+    suite_parser.add_argument("--analyzer", default=None, help="token analyzer (default: FETCHER_ANALYZER)")
+    suite_parser.add_argument("--k", type=int, default=10)
+    suite_parser.add_argument("--repeats", type=int, default=5, help="passes over the query set")
+    suite_parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc peak memory, which slows the builds down")
+    suite_parser.add_argument("--out", help="write results to this JSON file")
+    suite_parser.add_argument("--baseline", help="fail when worse than this earlier JSON result")
+    suite_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, as a fraction")
+
+    compare_parser = subparsers.add_parser("compare", help="regressions between two suite results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, as a fraction")
+
+    args = parser.parse_args()
+
+    if args.benchmark == "preprocess":
+        bench_preprocess(args.path, args.docs, args.batch_size, args.n_process)
+    elif args.benchmark == "index-memory":
+        bench_index_memory(args.path)
+    elif args.benchmark == "pruning":
+        bench_pruning(args.path, args.k)
+    elif args.benchmark == "startup":
+        sys.exit(0 if bench_startup(args.module, args.budget, args.top) else 1)
+    elif args.benchmark == "suite":
+        results = bench_suite(args.path, args.scales, args.analyzer, args.k, args.repeats, not args.no_memory)
+        if args.out:
+            with open(args.out, 'w', encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+        if args.baseline and not report_comparison(args.baseline, results, args.tolerance):
+            sys.exit(1)
+    elif args.benchmark == "compare":
+        with open(args.current, 'r', encoding="utf-8") as f:
+            current = json.load(f)
+        sys.exit(0 if report_comparison(args.baseline, current, args.tolerance) else 1)
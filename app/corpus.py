@@ -0,0 +1,212 @@
+import os
+import re
+import glob
+from preprocessing import preprocess_batch, ANALYZER
+
+NEWSGROUP_LINE = re.compile(r"^Newsgroup:\s*(\S+)\s*$")
+DOC_ID_LINE = re.compile(r"^document_id:\s*(\S+)\s*$", re.IGNORECASE)
+HEADER_LINE = re.compile(r"^([\w-]+):\s?(.*)$")
+
+def post_name(newsgroup: str, document_id: str) -> str:
+    '''
+    Document ids repeat across newsgroups, so posts are named by both
+    '''
+    return f"{newsgroup}/{document_id}"
+
+def iter_posts(file_path: str):
+    '''
+    Streams a newsgroup dump, yielding one post at a time as:
+    (document_id, newsgroup, header, body)
+
+    A post starts at a `Newsgroup:` line directly followed by a
+    `document_id:` line; the header runs until the first blank line.
+    '''
+    def finish(post):
+        document_id, newsgroup, header, body = post
+        return document_id, newsgroup, header, "".join(body).strip("\n")
+
+    post = None
+    in_header = False
+    pending = None  # `Newsgroup:` line waiting to see if a `document_id:` follows
+
+    with open(file_path, 'r', errors="replace") as f:
+        for line in f:
+            if pending is not None:
+                newsgroup_match, pending_line = pending
+                pending = None
+                doc_match = DOC_ID_LINE.match(line)
+
+                if doc_match:
+                    if post is not None:
+                        yield finish(post)
+                    post = (doc_match.group(1), newsgroup_match.group(1), {}, [])
+                    in_header = True
+                    continue
+                elif post is not None:
+                    post[3].append(pending_line)
+
+            newsgroup_match = NEWSGROUP_LINE.match(line)
+            if newsgroup_match:
+                pending = (newsgroup_match, line)
+                continue
+
+            if post is None:
+                continue
+
+            if in_header:
+                header_match = HEADER_LINE.match(line)
+                if header_match:
+                    post[2][header_match.group(1)] = header_match.group(2).strip()
+                    continue
+                in_header = False
+                if not line.strip():
+                    continue
+
+            post[3].append(line)
+
+    if pending is not None and post is not None:
+        post[3].append(pending[1])
+    if post is not None:
+        yield finish(post)
+
+def iter_corpus(path: str, sources: dict[str, str] = None):
+    '''
+    Streams every post from the files matching `path`, as:
+    (post_name, newsgroup, header, body)
+
+    The dumps repeat each post, so only the first copy of a name is kept.
+    When given, `sources` is filled with: Post_name -> File_name
+    '''
+    seen = set()
+
+    for file in sorted(glob.glob(path)):
+        for document_id, newsgroup, header, body in iter_posts(file):
+            name = post_name(newsgroup, document_id)
+            if name in seen:
+                continue
+            seen.add(name)
+            if sources is not None:
+                sources[name] = os.path.basename(file)
+
+            yield name, newsgroup, header, body
+
+def post_text(header: dict[str, str], body: str) -> str:
+    '''
+    Text that gets indexed for a post: its subject line followed by the body
+    '''
+    subject = header.get("Subject")
+    return f"{subject}\n{body}" if subject else body
+
+def load_posts(path: str, len_lim: int = None, tag: str = "CORPUS",
+               sources: dict[str, str] = None) -> dict[str, str]:
+    '''
+    Returns dictionary with: Post_name -> Content_String
+    '''
+    name_content = {}
+    current_file = None
+
+    for name, newsgroup, header, body in iter_corpus(path, sources):
+        if newsgroup != current_file:
+            current_file = newsgroup
+            print(f"[{tag}] Now Loading: \'{newsgroup}\', into memory")
+
+        text = post_text(header, body)
+        name_content[name] = text[:len_lim] if len_lim else text
+
+    return name_content
+
+def find_post(path: str, name: str) -> str:
+    '''
+    Returns the text of a single post, trying the file named after its
+    newsgroup before scanning the rest of the directory
+    '''
+    newsgroup = name.split("/", 1)[0]
+    likely = os.path.join(os.path.dirname(path), f"{newsgroup}.txt")
+    files = sorted(glob.glob(path), key=lambda file: file != likely)
+
+    for file in files:
+        for document_id, group, header, body in iter_posts(file):
+            if post_name(group, document_id) == name:
+                return post_text(header, body)
+
+    raise KeyError(name)
+
+class Corpus:
+    '''
+    Posts loaded and preprocessed once, shared by every retrieval model
+    '''
+    # Corpora pickled before the analyzer was selectable were all lemmatized with spaCy
+    analyzer = "spacy"
+
+    def __init__(self, folder_path: str, len_lim: int = None, analyzer: str = None):
+        self.folder_path = folder_path
+        self.len_lim = len_lim
+        self.analyzer = analyzer or ANALYZER
+        self.sources = {}
+        self.documents = load_posts(folder_path, len_lim, sources=self.sources)
+
+        print(f"[CORPUS] Preprocessing {len(self.documents)} posts with the {self.analyzer} analyzer")
+        self._set_tokens(preprocess_batch(list(self.documents.values()), analyzer=self.analyzer))
+
+    @classmethod
+    def from_tokens(cls, folder_path: str, documents: dict[str, str], token_lists: list[list[str]],
+                    sources: dict[str, str] = None, len_lim: int = None, analyzer: str = None) -> "Corpus":
+        '''
+        A corpus over posts that were already loaded and preprocessed
+        '''
+        corpus = cls.__new__(cls)
+        corpus.folder_path = folder_path
+        corpus.len_lim = len_lim
+        corpus.analyzer = analyzer or ANALYZER
+        corpus.sources = sources if sources is not None else {}
+        corpus.documents = documents
+        corpus._set_tokens(token_lists)
+        return corpus
+
+    def _set_tokens(self, token_lists: list[list[str]]):
+        self.tokens = dict(zip(self.documents, token_lists))
+        self.doc_lengths = {doc: len(tokens) for doc, tokens in self.tokens.items()}
+
+    def add_documents(self, texts: dict[str, str], sources: dict[str, str] = None) -> dict[str, list[str]]:
+        '''
+        Preprocesses and adds posts, replacing any with the same name.
+        Replaced posts move to the end, in step with `InvertedIndex.merge`.
+        Returns dictionary with: Post_name -> Tokens
+        '''
+        self.remove_documents([name for name in texts if name in self.documents])
+        texts = {name: text[:self.len_lim] if self.len_lim else text for name, text in texts.items()}
+        tokens = dict(zip(texts, preprocess_batch(list(texts.values()), analyzer=self.analyzer)))
+
+        self.documents.update(texts)
+        self.tokens.update(tokens)
+        self.doc_lengths.update((doc, len(doc_tokens)) for doc, doc_tokens in tokens.items())
+        self.sources.update(sources or {})
+
+        return tokens
+
+    def remove_documents(self, names):
+        for name in names:
+            for table in (self.documents, self.tokens, self.doc_lengths, self.sources):
+                table.pop(name, None)
+
+    def __setstate__(self, state: dict):
+        # Older pickles also kept a Counter per post; counts now come from `tokens` when needed
+        state.pop("term_counts", None)
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.documents)
+
+    @property
+    def avg_doc_length(self) -> float:
+        return sum(self.doc_lengths.values()) / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def processed_docs(self) -> dict[str, str]:
+        '''
+        Returns dictionary with: Post_name -> Preprocessed_String
+        '''
+        return {doc: " ".join(tokens) for doc, tokens in self.tokens.items()}
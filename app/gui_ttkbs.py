@@ -1,18 +1,30 @@
 import os
-import queue
-import threading
-import pandas as pd
-import seaborn as sns
 import ttkbootstrap as ttk
-import matplotlib.pyplot as plt
 
-from wordcloud import WordCloud
-from collections import Counter
-from preprocessing import preprocess
+from corpus import find_post
+from preprocessing import preprocess, warm_up
 from ttkbootstrap.constants import *
-from tkinter import filedialog, messagebox
-from retrieval_models import VectorSpaceModel, BooleanIR, BM25
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from tkinter import filedialog, messagebox, TclError
+from concurrent.futures import ThreadPoolExecutor
+from index_store import IndexStore
+from index_writer import sync_models
+from parallel_build import BUILD_WORKERS
+from result_cache import result_cache, query_key
+from retrieval_models import build_models
+
+# pandas, seaborn, matplotlib and wordcloud are only imported once a plot is
+# opened, and the analyzer's models load on the search pool once the window
+# is up, so neither delays startup
+
+# (result key, progress bar, pane title, has scores) for each results pane, left to right
+PANES = (
+    ("vsm", "Vector Space Model", "VSM Results", True),
+    ("bool", "Boolean Model", "Boolean Results", False),
+    ("bm25", "BM25 Model", "BM25 Results", True),
+)
+
+# Rows drawn per pane; every row is a few widgets, and boolean queries can match thousands of posts
+MAX_RENDERED_RESULTS = 50
 
 class IR_GUI(ttk.Window):
     def __init__(self, title: str = None, themename: str = "darkly", size: str = "820x720", **kwargs):
@@ -21,21 +33,18 @@ class IR_GUI(ttk.Window):
         self.minsize(720, 480)
         self.__setup_state()
         self.__setup_gui()
-
-        # Start progress monitoring thread
-        self.progress_monitor = threading.Thread(target=self.monitor_progress, daemon=True)
-        self.progress_monitor.start()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.after_idle(self.executor.submit, warm_up)
 
     def __setup_state(self):
         self.__path = None
+        self.__index_store = None
         self.__user_query = None
-        self.__can_search = True
-        self.__vsm_top_n = None
-        self.__bool_results = None
-        self.__bm25_results = None
-        self.result_queue = queue.Queue()
-        self.progress_queue = queue.Queue()
-        self.active_threads = []
+        self.__results = {}
+        self.__pending = set()
+        self.__futures = []
+        self.__generation = 0
+        self.executor = ThreadPoolExecutor(len(PANES), thread_name_prefix="search")
 
     def __setup_gui(self):
         self.style.configure('Results.TFrame', background='#2f3640')
@@ -142,15 +151,21 @@ class IR_GUI(ttk.Window):
 
     def set_path(self, input_path: str):
         self.__path = input_path
+        self.__index_store = IndexStore(input_path)
 
     def get_path(self):
         return self.__path
 
-    def set_query(self):
-        if not self.__can_search:
-            messagebox.showinfo("Processing", "Please wait for current search to complete")
-            return
+    def load_models(self) -> dict:
+        '''
+        The corpus and all three models, built in a single pass the first
+        time any search thread asks and shared by the rest
+        '''
+        path = self.get_path()
+        return self.__index_store.load_or_build("models", lambda: build_models(path, BUILD_WORKERS),
+                                                sync_models)
 
+    def set_query(self):
         if not self.__path:
             messagebox.showwarning("No Directory", "Please select a directory first")
             return
@@ -162,107 +177,122 @@ class IR_GUI(ttk.Window):
 
         self.__user_query = query
         self.text_bar.delete(0, "end")
-        self.cannot_search()
+        self.schedule_searches(query)
+
+    def schedule_searches(self, query: str):
+        '''
+        Cancels the searches of the previous query and submits one per model
+        to the shared pool. Each pane is filled as soon as its model finishes;
+        results of a superseded query are dropped when they arrive.
+        '''
+        self.cancel_searches()
+        self.__generation += 1
+        generation = self.__generation
+
+        self.__results = {}
+        self.__pending = {key for key, _, _, _ in PANES}
         self.status_label.configure(text="Searching...", bootstyle="warning")
 
-        # Reset progress bars
-        for progress_bar in self.progress_bars.values():
-            progress_bar['value'] = 0
-
-        # Start search threads
-        self.active_threads = [
-            threading.Thread(target=self.vector_search, args=(query,), daemon=True),
-            threading.Thread(target=self.bool_search, args=(query,), daemon=True),
-            threading.Thread(target=self.BM25_search, args=(query,), daemon=True)
-        ]
-
-        for thread in self.active_threads:
-            thread.start()
-
-        # Start monitoring thread
-        self.monitor_thread = threading.Thread(target=self.monitor_searches, 
-                                             daemon=True)
-        self.monitor_thread.start()
-
-    def vector_search(self, q: str, top_n: int = 10):
-        try:
-            self.progress_queue.put(('Vector Space Model', 0, 'Loading documents'))
-            vsm_instance = VectorSpaceModel(self.get_path())
-
-            self.progress_queue.put(('Vector Space Model', 50, 'Processing query'))
-            results = vsm_instance.return_top_n(q, top_n)
-
-            self.progress_queue.put(('Vector Space Model', 100, 'Complete'))
-            self.result_queue.put(('vsm', results))
-        except Exception as e:
-            self.progress_queue.put(('Vector Space Model', 0, f'Error: {str(e)}'))
-
-    def bool_search(self, q: str):
-        try:
-            self.progress_queue.put(('Boolean Model', 0, 'Loading documents'))
-            bool_instance = BooleanIR(self.get_path())
-
-            self.progress_queue.put(('Boolean Model', 50, 'Processing query'))
-            results = bool_instance.query(q)
-
-            self.progress_queue.put(('Boolean Model', 100, 'Complete'))
-            self.result_queue.put(('bool', results))
-        except Exception as e:
-            self.progress_queue.put(('Boolean Model', 0, f'Error: {str(e)}'))
-
-    def BM25_search(self, q: str):
+        searches = {"vsm": self.vector_search, "bool": self.bool_search, "bm25": self.BM25_search}
+        for key, model, _, _ in PANES:
+            self.progress_bars[model]['bar']['value'] = 0
+            self.progress_bars[model]['status'].configure(text="Queued")
+
+            future = self.executor.submit(searches[key], query, generation)
+            future.add_done_callback(lambda f, key=key: self.post(self.show_result, generation, key, f))
+            self.__futures.append(future)
+
+    def cancel_searches(self):
+        '''
+        Cancels searches still queued; running ones finish but their results are ignored
+        '''
+        for future in self.__futures:
+            future.cancel()
+        self.__futures = []
+        self.__generation += 1
+
+    def post(self, callback, *args):
+        '''
+        Runs `callback(*args)` on the Tk thread. Safe to call from any thread.
+        '''
         try:
-            self.progress_queue.put(('BM25 Model', 0, 'Loading documents'))
-            bm25_instance = BM25(self.get_path())
-
-            self.progress_queue.put(('BM25 Model', 50, 'Processing query'))
-            results = bm25_instance.compute_bm25(q)
+            self.after(0, callback, *args)
+        except (RuntimeError, TclError):
+            pass  # The window is gone
+
+    def report_progress(self, generation: int, model: str, progress: int, status: str):
+        self.post(self.show_progress, generation, model, progress, status)
+
+    def is_current(self, generation: int) -> bool:
+        return generation == self.__generation
+
+    def vector_search(self, q: str, generation: int, top_n: int = 10):
+        self.report_progress(generation, 'Vector Space Model', 0, 'Loading documents')
+        vsm_instance = self.load_models()["vsm"]
+        if not self.is_current(generation):
+            return None
+
+        self.report_progress(generation, 'Vector Space Model', 50, 'Processing query')
+        return result_cache.get_or_compute(query_key("vsm", vsm_instance, q, top_n),
+                                           lambda: vsm_instance.return_top_n(q, top_n))
+
+    def bool_search(self, q: str, generation: int):
+        self.report_progress(generation, 'Boolean Model', 0, 'Loading documents')
+        bool_instance = self.load_models()["bool"]
+        if not self.is_current(generation):
+            return None
+
+        self.report_progress(generation, 'Boolean Model', 50, 'Processing query')
+        return result_cache.get_or_compute(query_key("bool", bool_instance, q),
+                                           lambda: bool_instance.query(q))
+
+    def BM25_search(self, q: str, generation: int, top_n: int = 10):
+        self.report_progress(generation, 'BM25 Model', 0, 'Loading documents')
+        bm25_instance = self.load_models()["bm25"]
+        if not self.is_current(generation):
+            return None
+
+        self.report_progress(generation, 'BM25 Model', 50, 'Processing query')
+        return result_cache.get_or_compute(query_key("bm25", bm25_instance, q, top_n, k1=1.5, b=0.75),
+                                           lambda: bm25_instance.compute_bm25(q, top_n=top_n))
+
+    def show_progress(self, generation: int, model: str, progress: int, status: str):
+        if self.is_current(generation) and model in self.progress_bars:
+            self.progress_bars[model]['bar']['value'] = progress
+            self.progress_bars[model]['status'].configure(text=status)
+
+    def show_result(self, generation: int, key: str, future):
+        '''
+        Tk side of a finished search: fills that model's pane, and marks the
+        query done once every model has reported
+        '''
+        if not self.is_current(generation) or future.cancelled():
+            return
 
-            self.progress_queue.put(('BM25 Model', 100, 'Complete'))
-            self.result_queue.put(('bm25', results))
-        except Exception as e:
-            self.progress_queue.put(('BM25 Model', 0, f'Error: {str(e)}'))
-
-    def monitor_searches(self):
-        while any(thread.is_alive() for thread in self.active_threads):
-            self.update()
-
-        self.active_threads.clear()
-        self.update_boxes()
-        self.can_search()
-        self.status_label.configure(text="Ready", bootstyle="success")
-
-    def monitor_progress(self):
-        while True:
-            try:
-                model, progress, status = self.progress_queue.get(timeout=0.1)
-                if model in self.progress_bars:
-                    self.progress_bars[model]['bar']['value'] = progress
-                    self.progress_bars[model]['status'].configure(text=status)
-            except queue.Empty:
-                continue
-
-    def update_boxes(self):
-        while not self.result_queue.empty():
-            result_type, results = self.result_queue.get()
-            if result_type == 'vsm':
-                self.__vsm_top_n = results
-            elif result_type == 'bool':
-                self.__bool_results = results
-            elif result_type == 'bm25':
-                self.__bm25_results = results
-
-        # Update VSM Results
-        vsm_content = self.__vsm_top_n or []
-        self.update_box(self.boxes[0], "VSM Results", vsm_content, has_score=True)
-
-        # Update Boolean Results
-        bool_content = [(doc, 1.0) for doc in (self.__bool_results or [])]
-        self.update_box(self.boxes[1], "Boolean Results", bool_content, has_score=False)
-
-        # BM25 Results
-        bm25_content = self.__bm25_results or []
-        self.update_box(self.boxes[2], "BM25 Results", bm25_content, has_score=True)
+        model = next(model for pane_key, model, _, _ in PANES if pane_key == key)
+        error = future.exception()
+        if error is not None:
+            self.show_progress(generation, model, 0, f'Error: {str(error)}')
+        else:
+            self.__results[key] = future.result()
+            self.show_progress(generation, model, 100, 'Complete')
+            self.update_pane(key)
+
+        self.__pending.discard(key)
+        if not self.__pending:
+            self.__futures = []
+            self.status_label.configure(text="Ready", bootstyle="success")
+
+    def update_pane(self, key: str):
+        i, (_, _, title, has_score) = next((i, pane) for i, pane in enumerate(PANES) if pane[0] == key)
+        results = self.__results.get(key) or []
+        content = results if has_score else [(doc, 1.0) for doc in sorted(results)]
+        self.update_box(self.boxes[i], title, content, has_score=has_score)
+
+    def close(self):
+        self.cancel_searches()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
 
     def update_box(self, box, title, content, has_score=True):
         for widget in box.winfo_children():
@@ -285,7 +315,9 @@ class IR_GUI(ttk.Window):
         if not content:
             text.insert(END, "No results found.")
         else:
-            for item in content:
+            text.insert(END, f"{len(content)} result{'s' if len(content) != 1 else ''}\n", "instruction")
+
+            for item in content[:MAX_RENDERED_RESULTS]:
                 if isinstance(item, tuple):
                     doc_name, score = item
                     frame = ttk.Frame(text)
@@ -310,17 +342,14 @@ class IR_GUI(ttk.Window):
                 else:
                     text.insert(END, f"{item}\n")
 
+            if len(content) > MAX_RENDERED_RESULTS:
+                text.insert(END, f"… and {len(content) - MAX_RENDERED_RESULTS} more\n", "instruction")
+
         text.configure(state=DISABLED)
 
     def get_query(self):
         return self.__user_query
 
-    def can_search(self):
-        self.__can_search = True
-
-    def cannot_search(self):
-        self.__can_search = False
-
     def create_doc_menu(self, doc_name, parent):
         menu = ttk.Menu(parent)
         menu.add_command(label="Word Cloud", 
@@ -337,26 +366,27 @@ class IR_GUI(ttk.Window):
             menu.grab_release()
 
     def show_wordcloud(self, doc_name):
-        with open(f"{os.path.dirname(self.get_path())}/{doc_name}", 'r') as f:
-            text = f.read()
+        from wordcloud import WordCloud
+
+        text = find_post(self.get_path(), doc_name)
 
         wordcloud = WordCloud(width=800, height=400, 
                             background_color='white').generate(text)
 
         self.show_plot_window("Word Cloud", wordcloud)
 
-    def show_frequency(self, doc_name, len_lim: int = 100_000):
+    def show_frequency(self, doc_name, len_lim: int = None):
+        import pandas as pd
+        import seaborn as sns
+        import matplotlib.pyplot as plt
+
         try:
-            with open(f"{os.path.dirname(self.get_path())}/{doc_name}", 'r') as f:
-                if len_lim:
-                    text = f.read(len_lim)
-                else:
-                    text = f.read()
+            text = find_post(self.get_path(), doc_name)[:len_lim]
 
-                word_freq = {}
-                text_preprocessed = preprocess(text)
-                for word in text_preprocessed:
-                    word_freq[word] = word_freq.get(word, 0) + 1
+            word_freq = {}
+            text_preprocessed = preprocess(text)
+            for word in text_preprocessed:
+                word_freq[word] = word_freq.get(word, 0) + 1
 
             # Get top 20 words
             top_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:20]
@@ -377,8 +407,10 @@ class IR_GUI(ttk.Window):
                                 "Please perform a search first.")
             return
 
+        import matplotlib.pyplot as plt
+
         # Get similarity score from VSM results
-        score = next((score for doc, score in self.__bm25_results 
+        score = next((score for doc, score in self.__results.get("bm25") or []
                     if doc == doc_name), 0)
 
         fig, ax = plt.subplots(figsize=(6, 3))
@@ -388,6 +420,10 @@ class IR_GUI(ttk.Window):
         self.show_plot_window("Query Similarity", fig)
 
     def show_plot_window(self, title, plot_obj):
+        import matplotlib.pyplot as plt
+        from wordcloud import WordCloud
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         window = ttk.Toplevel(self)
         window.title(title)
         window.geometry("800x600")
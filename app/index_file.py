@@ -0,0 +1,256 @@
+import os
+import json
+import struct
+import argparse
+import numpy as np
+from inverted_index import InvertedIndex
+
+MAGIC = b"FETCHIDX"
+FORMAT_VERSION = 4
+
+# Every array starts on a multiple of this many bytes
+ALIGNMENT = 64
+
+# File layout:
+#   MAGIC | uint32 format version | uint64 header length | JSON header | arrays
+# The JSON header holds scalar metadata plus, for every array, its dtype,
+# shape and absolute byte offset. Arrays are stored raw and little-endian,
+# so opening a file only parses the header and maps the rest with np.memmap.
+PREAMBLE = struct.Struct("<8sIQ")
+
+class StringTable:
+    '''
+    Read-only sequence of strings held as one UTF-8 blob plus offsets.
+
+    `order` lists the ids sorted by their encoded bytes, so `get` finds
+    a string's id by binary search instead of building a dict on open.
+    '''
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, order: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.order = order
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _bytes(self, i: int) -> bytes:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._bytes(i).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def get(self, name: str, default=None):
+        '''
+        Id of `name`, or `default` when it is not in the table
+        '''
+        key = name.encode("utf-8")
+        low, high = 0, len(self.order)
+
+        while low < high:
+            mid = (low + high) // 2
+            if self._bytes(self.order[mid]) < key:
+                low = mid + 1
+            else:
+                high = mid
+
+        if low < len(self.order) and self._bytes(self.order[low]) == key:
+            return int(self.order[low])
+        return default
+
+    def lookup(self) -> "StringLookup":
+        return StringLookup(self)
+
+    @staticmethod
+    def encode(strings) -> dict[str, np.ndarray]:
+        '''
+        The blob, offsets and order arrays of a string table
+        '''
+        encoded = [string.encode("utf-8") for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(string) for string in encoded], out=offsets[1:])
+        order = np.array(sorted(range(len(encoded)), key=encoded.__getitem__), dtype=np.int32)
+
+        return {"blob": np.frombuffer(b"".join(encoded), dtype=np.uint8), "offsets": offsets, "order": order}
+
+class StringLookup:
+    '''
+    Mapping view of a `StringTable`: string -> id
+    '''
+    def __init__(self, table: StringTable):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __iter__(self):
+        return iter(self.table)
+
+    def __contains__(self, name) -> bool:
+        return isinstance(name, str) and self.table.get(name) is not None
+
+    def __getitem__(self, name: str) -> int:
+        i = self.table.get(name)
+        if i is None:
+            raise KeyError(name)
+        return i
+
+    def get(self, name: str, default=None):
+        return self.table.get(name, default)
+
+def _string_arrays(prefix: str, strings) -> dict[str, np.ndarray]:
+    return {f"{prefix}_{part}": array for part, array in StringTable.encode(strings).items()}
+
+def write_index_file(path: str, models: dict):
+    '''
+    Writes the index and VSM matrix of `build_models` output to one binary file
+    '''
+    index = models["index"]
+    docs, freqs = index.flat_postings()
+
+    arrays = {
+        **_string_arrays("terms", index.term_names),
+        **_string_arrays("docs", index.doc_names),
+        "doc_freqs": index.doc_freqs,
+        "offsets": index.offsets,
+        "postings_docs": docs,
+        "postings_freqs": freqs,
+        "doc_lengths": index.doc_lengths,
+    }
+    if index.positional:
+        arrays["position_offsets"] = index.position_offsets
+        arrays["positions_data"] = np.frombuffer(index.positions_data, dtype=np.uint8)
+
+    vsm = models.get("vsm")
+    if vsm is not None:
+        rows, columns = vsm.tf_idf_scores.tocsr(), vsm._column_index()
+        vectorizer = vsm.custom_vectorizer
+        vocabulary = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+
+        arrays.update({
+            **_string_arrays("vocab", vocabulary),
+            "vsm_idf": vectorizer.idf_,
+            "vsm_data": rows.data, "vsm_indices": rows.indices, "vsm_indptr": rows.indptr,
+            "vsm_csc_data": columns.data, "vsm_csc_indices": columns.indices,
+            "vsm_csc_indptr": columns.indptr, "vsm_column_max": vsm._column_max,
+        })
+
+    # Lay the arrays out first so the header can record absolute offsets
+    arrays = {name: np.ascontiguousarray(array, dtype=np.asarray(array).dtype.newbyteorder("<"))
+              for name, array in arrays.items()}
+    header = {"folder_path": models["corpus"].folder_path if models.get("corpus") else None,
+              "version": index.version, "build_id": index.build_id, "analyzer": index.analyzer,
+              "positional": index.positional,
+              "vsm_shape": list(vsm.tf_idf_scores.shape) if vsm is not None else None,
+              "vsm_weighting": {"tf": vsm.tf, "idf": vsm.idf} if vsm is not None else None,
+              "arrays": {}}
+
+    def layout(start: int) -> int:
+        position = start
+        for name, array in arrays.items():
+            position = -(-position // ALIGNMENT) * ALIGNMENT
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape),
+                                      "offset": position}
+            position += array.nbytes
+        return position
+
+    # Offsets depend on the header's own length, so lay out until it fits
+    header_length = 0
+    while True:
+        layout(PREAMBLE.size + header_length)
+        header_bytes = json.dumps(header).encode("utf-8")
+        if len(header_bytes) <= header_length:
+            header_bytes = header_bytes.ljust(header_length)
+            break
+        header_length = len(header_bytes)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b"\0" * (header["arrays"][name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+class IndexFile:
+    '''
+    An index file opened read-only through `np.memmap`. Opening only reads
+    the header; pages are loaded on first access and shared through the
+    OS page cache by every process that maps the same file.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as f:
+            magic, version, header_length = PREAMBLE.unpack(f.read(PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' is not an index file")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"'{path}' has index format {version}, expected {FORMAT_VERSION}")
+            self.header = json.loads(f.read(header_length))
+
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+        self.folder_path = self.header["folder_path"]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.header["arrays"]
+
+    def array(self, name: str) -> np.ndarray:
+        spec = self.header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        if not count:
+            return np.zeros(spec["shape"], dtype=dtype)
+
+        return np.frombuffer(self._map, dtype=dtype, count=count, offset=spec["offset"]).reshape(spec["shape"])
+
+    def strings(self, prefix: str) -> StringTable:
+        return StringTable(self.array(f"{prefix}_blob"), self.array(f"{prefix}_offsets"),
+                           self.array(f"{prefix}_order"))
+
+    def inverted_index(self) -> InvertedIndex:
+        '''
+        An `InvertedIndex` whose arrays are views into the mapped file
+        '''
+        index = InvertedIndex(analyzer=self.header["analyzer"])
+        index.version = self.header["version"]
+        index.build_id = self.header["build_id"]
+
+        index.term_names = self.strings("terms")
+        index.terms = index.term_names.lookup()
+        index.doc_names = self.strings("docs")
+        index.doc_ids = index.doc_names.lookup()
+
+        for name in ("doc_freqs", "offsets", "postings_docs", "postings_freqs", "doc_lengths"):
+            setattr(index, name, self.array(name))
+
+        if self.header["positional"]:
+            index.position_offsets = self.array("position_offsets")
+            index.positions_data = self.array("positions_data")
+
+        return index
+
+def open_index_file(path: str) -> IndexFile:
+    return IndexFile(path)
+
+if __name__ == "__main__":
+    from preprocessing import ANALYZERS
+    from retrieval_models import build_models
+
+    parser = argparse.ArgumentParser(description="Build a memory-mapped Fetcher index file")
+    parser.add_argument("out", help="Index file to write")
+    parser.add_argument("--path", default="data/*.txt", help="Glob of newsgroup dump files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--analyzer", choices=ANALYZERS, default=None,
+                        help="Token analyzer (default: FETCHER_ANALYZER, else spacy)")
+    args = parser.parse_args()
+
+    write_index_file(args.out, build_models(args.path, args.workers, args.analyzer))
+    print(f"[INDEX] Wrote {args.out} ({os.path.getsize(args.out) / 2**20:.1f} MiB)")
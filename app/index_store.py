@@ -0,0 +1,179 @@
+import os
+import glob
+import json
+import pickle
+import hashlib
+import threading
+
+INDEX_DIR = os.environ.get("FETCHER_INDEX_DIR",
+                           os.path.join(os.path.expanduser("~"), ".cache", "fetcher"))
+
+# Built models kept alive for the lifetime of the process, keyed on
+# (folder_path, name) -> (fingerprint digest, model)
+_memory_cache = {}
+_memory_lock = threading.Lock()
+
+def _hash_file(file_path: str, chunk_size: int = 1 << 20) -> str:
+    '''
+    SHA-1 of a file's content, read in chunks
+    '''
+    digest = hashlib.sha1()
+
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def fingerprint(folder_path: str, previous: dict = None) -> dict[str, list]:
+    '''
+    Returns dictionary with: File_name -> [mtime_ns, size, sha1]
+
+    Files whose mtime and size match `previous` reuse its hash, so an
+    unchanged corpus is fingerprinted without reading it.
+    '''
+    previous = previous or {}
+    files = {}
+
+    for file in sorted(glob.glob(folder_path)):
+        name = os.path.basename(file)
+        stat = os.stat(file)
+        old = previous.get(name)
+
+        if old and old[0] == stat.st_mtime_ns and old[1] == stat.st_size:
+            files[name] = old
+        else:
+            files[name] = [stat.st_mtime_ns, stat.st_size, _hash_file(file)]
+
+    return files
+
+def changed_files(old: dict[str, list], new: dict[str, list]) -> list[str]:
+    '''
+    Names of the files added, removed or whose content differs between two fingerprints
+    '''
+    return sorted(name for name in set(old) | set(new)
+                  if (old.get(name) or [None] * 3)[1:] != (new.get(name) or [None] * 3)[1:])
+
+def _digest(files: dict[str, list]) -> str:
+    '''
+    Content-only digest; touching a file without changing it keeps the index valid
+    '''
+    content = sorted((name, entry[1], entry[2]) for name, entry in files.items())
+    return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+class IndexStore:
+    '''
+    On-disk store of built retrieval models for a single document directory.
+
+    Each model is pickled next to a manifest of the files it was built
+    from; a model is only reused while every file still has the same
+    size and content hash.
+    '''
+    def __init__(self, folder_path: str, index_dir: str = INDEX_DIR):
+        self.folder_path = folder_path
+        key = hashlib.sha1(os.path.abspath(folder_path).encode()).hexdigest()[:16]
+        self.path = os.path.join(index_dir, key)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, name: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.json")
+
+    def _model_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.pkl")
+
+    def _read_manifest(self, name: str) -> dict:
+        try:
+            with open(self._manifest_path(name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, name: str, files: dict, digest: str, model) -> None:
+        '''
+        Writes through temporary files so a crash never leaves a half-written index
+        '''
+        os.makedirs(self.path, exist_ok=True)
+
+        model_tmp = self._model_path(name) + ".tmp"
+        with open(model_tmp, 'wb') as f:
+            pickle.dump(model, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(model_tmp, self._model_path(name))
+
+        manifest_tmp = self._manifest_path(name) + ".tmp"
+        with open(manifest_tmp, 'w') as f:
+            json.dump({"folder_path": self.folder_path, "digest": digest, "files": files}, f)
+        os.replace(manifest_tmp, self._manifest_path(name))
+
+    def load_or_build(self, name: str, builder, updater=None):
+        '''
+        Returns the model stored under `name`, calling `builder()` and
+        saving its result when there is no valid copy in memory or on disk.
+
+        With an `updater(model, changed_file_names)`, a stale model is
+        brought up to date through it instead of being rebuilt.
+        '''
+        with self._lock(name):
+            manifest = self._read_manifest(name)
+            files = fingerprint(self.folder_path, manifest.get("files"))
+            digest = _digest(files)
+            memory_key = (os.path.abspath(self.folder_path), name)
+
+            with _memory_lock:
+                cached = _memory_cache.get(memory_key)
+            if cached and cached[0] == digest:
+                return cached[1]
+
+            model = None
+            if manifest.get("digest") == digest or (updater and manifest):
+                try:
+                    if cached and manifest.get("digest") == cached[0]:
+                        model = cached[1]
+                    else:
+                        with open(self._model_path(name), 'rb') as f:
+                            model = pickle.load(f)
+                        print(f"[INDEX] Loaded \'{name}\' from {self.path}")
+                except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+                    model = None
+
+            if model is not None and manifest.get("digest") != digest:
+                changed = changed_files(manifest.get("files", {}), files)
+                print(f"[INDEX] Updating \'{name}\' for {len(changed)} changed files")
+                try:
+                    model = updater(model, changed)
+                except ValueError:
+                    model = None
+                if model is not None:
+                    self._write(name, files, digest, model)
+
+            if model is None:
+                print(f"[INDEX] Building \'{name}\' for {self.folder_path}")
+                model = builder()
+                self._write(name, files, digest, model)
+
+            with _memory_lock:
+                _memory_cache[memory_key] = (digest, model)
+
+            return model
+
+    def invalidate(self, name: str = None) -> None:
+        '''
+        Drops one stored model, or all of them, from memory and disk
+        '''
+        if name:
+            names = [name]
+        elif os.path.isdir(self.path):
+            names = [f[:-len(".json")] for f in os.listdir(self.path) if f.endswith(".json")]
+        else:
+            names = []
+
+        for n in names:
+            with _memory_lock:
+                _memory_cache.pop((os.path.abspath(self.folder_path), n), None)
+            for path in (self._manifest_path(n), self._model_path(n)):
+                if os.path.exists(path):
+                    os.remove(path)
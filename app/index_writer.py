@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import Counter
+from corpus import load_posts
+from inverted_index import InvertedIndex
+
+# Buffered changes that trigger an automatic commit
+SEGMENT_SIZE = 1000
+
+class IndexWriter:
+    '''
+    Applies post adds, updates and deletes to the models from `build_models`.
+
+    Changes are buffered. `commit` preprocesses the buffered posts in one
+    batch, indexes only them as a small segment and merges that segment
+    into the live index, so the rest of the corpus is never re-tokenized.
+    A commit happens automatically once `segment_size` changes are buffered.
+    '''
+    def __init__(self, models: dict, segment_size: int = SEGMENT_SIZE):
+        self.models = models
+        self.corpus = models["corpus"]
+        self.segment_size = segment_size
+        self._added = {}
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._added) + len(self._deleted)
+
+    def add_document(self, name: str, text: str, source: str = None):
+        '''
+        Adds a post, or replaces the post with the same name
+        '''
+        with self._lock:
+            self._added[name] = (text, source)
+            self._deleted.discard(name)
+
+        if len(self) >= self.segment_size:
+            self.commit()
+
+    def update_document(self, name: str, text: str, source: str = None):
+        self.add_document(name, text, source)
+
+    def delete_document(self, name: str):
+        with self._lock:
+            self._added.pop(name, None)
+            self._deleted.add(name)
+
+        if len(self) >= self.segment_size:
+            self.commit()
+
+    def commit(self) -> InvertedIndex:
+        '''
+        Merges the buffered changes into the index and refreshes every model.
+        Returns the index now in use.
+        '''
+        with self._lock:
+            added, deleted = self._added, self._deleted
+            self._added, self._deleted = {}, set()
+
+            index = self.models["index"]
+            deleted = {name for name in deleted if name in self.corpus.documents}
+            if not added and not deleted:
+                return index
+
+            self.corpus.remove_documents(deleted)
+            tokens = self.corpus.add_documents(
+                {name: text for name, (text, _) in added.items()},
+                {name: source for name, (_, source) in added.items() if source})
+
+            segment = InvertedIndex(tokens=tokens, analyzer=self.corpus.analyzer) if index.positional \
+                else InvertedIndex({doc: Counter(doc_tokens) for doc, doc_tokens in tokens.items()},
+                                   analyzer=self.corpus.analyzer)
+            index = index.merge(segment, deleted)
+
+            self.models["index"] = index
+            self.models["bool"].refresh(index)
+            self.models["bm25"].refresh(index)
+            self.models["vsm"].refresh(index)
+
+            print(f"[INDEX] Merged {len(added)} added or updated and {len(deleted)} deleted posts")
+            return index
+
+    def sync(self, file_names) -> InvertedIndex:
+        '''
+        Re-reads the named files of the corpus directory and commits the
+        posts that were added, changed or removed since they were indexed
+        '''
+        sources = getattr(self.corpus, "sources", None)
+        if sources is None:
+            raise ValueError("Corpus was built without source tracking; rebuild it instead")
+
+        folder = os.path.dirname(self.corpus.folder_path)
+        for file_name in file_names:
+            old = {name for name, source in sources.items() if source == file_name}
+            path = os.path.join(folder, file_name)
+            new = load_posts(path, self.corpus.len_lim, tag="INDEX") if os.path.exists(path) else {}
+
+            for name in old - set(new):
+                self.delete_document(name)
+            for name, text in new.items():
+                # The first file a post appears in keeps it
+                if sources.get(name, file_name) != file_name:
+                    continue
+                if self.corpus.documents.get(name) != text:
+                    self.add_document(name, text, file_name)
+
+        return self.commit()
+
+def sync_models(models: dict, file_names) -> dict:
+    '''
+    `IndexStore` updater: brings stored models up to date with the changed files
+    '''
+    IndexWriter(models).sync(file_names)
+    return models
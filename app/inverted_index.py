@@ -0,0 +1,497 @@
+import sys
+import uuid
+import numpy as np
+from ranking import top_matches
+from collections import Counter
+
+EMPTY = np.zeros(0, dtype=np.int32)
+
+def varint_lengths(values: np.ndarray) -> np.ndarray:
+    '''
+    Bytes each value takes once varint encoded
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28):
+        n_bytes += values >= (1 << bits)
+    return n_bytes
+
+def varint_encode(values: np.ndarray) -> bytes:
+    '''
+    LEB128-style varint encoding of non-negative integers, vectorized
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    n_bytes = varint_lengths(values)
+
+    starts = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(n_bytes[:-1], out=starts[1:])
+    out = np.zeros(int(n_bytes.sum()), dtype=np.uint8)
+
+    for k in range(5):
+        mask = n_bytes > k
+        if not mask.any():
+            break
+        chunk = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = chunk | more
+
+    return out.tobytes()
+
+def varint_decode(data: bytes) -> np.ndarray:
+    '''
+    Inverse of `varint_encode`
+    '''
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return EMPTY.copy()
+
+    ends = raw < 0x80
+    group = np.zeros(len(raw), dtype=np.int64)
+    np.cumsum(ends[:-1], out=group[1:])
+    group_start = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shift = 7 * (np.arange(len(raw)) - group_start[group])
+
+    parts = (raw & 0x7F).astype(np.int64) << shift
+    return np.bincount(group, weights=parts).astype(np.int64)
+
+def gather_ranges(data: bytes, starts: np.ndarray, lengths: np.ndarray) -> bytes:
+    '''
+    Concatenation of the byte ranges `data[start:start + length]`, in the given order
+    '''
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+    return np.frombuffer(data, dtype=np.uint8)[gather].tobytes()
+
+def deep_sizeof(obj, seen: set = None) -> int:
+    '''
+    Approximate memory held by a nest of dicts, sets, lists and NumPy arrays
+    '''
+    seen = seen if seen is not None else set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj) if obj.base is None else sys.getsizeof(obj)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+
+    return size
+
+class InvertedIndex:
+    '''
+    Array-backed inverted index.
+
+    Terms and document names are interned to integer ids. Postings are
+    stored term-major in three flat arrays, CSR style: the postings of
+    term `t` are `doc_ids[offsets[t]:offsets[t + 1]]` (sorted ascending)
+    with matching `freqs`. With `compress=True` each term's doc-id gaps
+    and frequencies are kept as varint bytes instead and decoded on access.
+    '''
+    # Name of the preprocessing analyzer the tokens came from; None for the default
+    analyzer = None
+
+    def __init__(self, term_counts: dict[str, Counter] = None, compress: bool = False,
+                 tokens: dict[str, list[str]] = None, analyzer: str = None):
+        '''
+        Built from per-document term counts, or from token streams when
+        `tokens` is given, in which case term positions are recorded too
+        '''
+        positional = tokens is not None
+        if positional:
+            term_counts = tokens
+        term_counts = term_counts or {}
+
+        # `version` counts incremental updates; `build_id` is unique to every built or merged index
+        self.version = 0
+        self.build_id = uuid.uuid4().hex
+        self.analyzer = analyzer
+        self.doc_names = list(term_counts)
+        self.doc_ids = {doc: i for i, doc in enumerate(self.doc_names)}
+
+        terms = {}
+        term_column, doc_column, freq_column = [], [], []
+        position_gaps, position_counts = [], []
+        doc_lengths = []
+
+        for doc_id, counts in enumerate(term_counts.values()):
+            if positional:
+                doc_lengths.append(len(counts))
+                counts = self._positions_of(counts)
+            else:
+                doc_lengths.append(sum(counts.values()))
+
+            for term, freq in counts.items():
+                term_id = terms.setdefault(term, len(terms))
+                term_column.append(term_id)
+                doc_column.append(doc_id)
+
+                if positional:
+                    freq_column.append(len(freq))
+                    position_counts.append(len(freq))
+                    position_gaps.append(freq[0])
+                    position_gaps.extend(b - a for a, b in zip(freq, freq[1:]))
+                else:
+                    freq_column.append(freq)
+
+        self.doc_lengths = np.array(doc_lengths, dtype=np.int32)
+
+        positions = None
+        if positional:
+            gaps = np.array(position_gaps, dtype=np.int64)
+            build_offsets = np.zeros(len(position_counts) + 1, dtype=np.int64)
+            np.cumsum(np.add.reduceat(varint_lengths(gaps), np.cumsum([0] + position_counts[:-1]))
+                      if len(gaps) else [], out=build_offsets[1:])
+            positions = (varint_encode(gaps), build_offsets[:-1], np.diff(build_offsets))
+
+        self._assemble(list(terms), np.array(term_column, dtype=np.int32),
+                       np.array(doc_column, dtype=np.int32), np.array(freq_column, dtype=np.int32),
+                       positions)
+
+        self.compressed = None
+        if compress:
+            self.compress()
+
+    def _assemble(self, term_names: list[str], term_column: np.ndarray, doc_column: np.ndarray,
+                  freq_column: np.ndarray, positions: tuple = None):
+        '''
+        Lays postings given in any term order out term-major. Within a term
+        they must already be in ascending doc order. `positions` is
+        (data, starts, lengths): each posting's varint bytes in `data`.
+        '''
+        self.term_names = term_names
+        self.terms = {term: i for i, term in enumerate(term_names)}
+
+        # Stable sort keeps doc ids ascending within every term
+        order = np.argsort(term_column, kind="stable")
+        self.doc_freqs = np.bincount(term_column, minlength=len(term_names)).astype(np.int32)
+        self.offsets = np.zeros(len(term_names) + 1, dtype=np.int64)
+        np.cumsum(self.doc_freqs, out=self.offsets[1:])
+
+        self.postings_docs = doc_column[order]
+        self.postings_freqs = freq_column[order]
+
+        # Positions are delta+varint encoded per posting and laid out in the
+        # same term-major order as the postings: posting j's bytes are
+        # positions_data[position_offsets[j]:position_offsets[j + 1]]
+        self.positions_data = None
+        if positions is not None:
+            data, starts, lengths = positions
+            self.position_offsets = np.zeros(len(order) + 1, dtype=np.int64)
+            np.cumsum(lengths[order], out=self.position_offsets[1:])
+            self.positions_data = gather_ranges(data, starts[order], lengths[order])
+
+    @staticmethod
+    def concatenate(segments: list["InvertedIndex"], deleted=()) -> "InvertedIndex":
+        '''
+        One index over the documents of every segment, in segment order.
+        A document is dropped when it is in `deleted` or a later segment
+        holds a document of the same name. Works on the postings arrays
+        directly, so nothing is re-tokenized; terms are numbered in order
+        of first appearance, as in a single build over the same documents.
+        '''
+        positional = {segment.positional for segment in segments}
+        if len(positional) > 1:
+            raise ValueError("Cannot merge positional indexes with non-positional ones")
+        positional = positional.pop() if positional else False
+
+        analyzers = {segment.analyzer for segment in segments}
+        if len(analyzers) > 1:
+            raise ValueError(f"Cannot merge indexes built with different analyzers: {sorted(map(str, analyzers))}")
+
+        # Later segments win, so walk them backwards collecting the names already taken
+        taken = set(deleted)
+        keeps = []
+        for segment in reversed(segments):
+            keeps.append(np.array([doc not in taken for doc in segment.doc_names], dtype=bool))
+            taken.update(segment.doc_names)
+        keeps.reverse()
+
+        terms = {}
+        doc_names, doc_lengths = [], []
+        term_parts, doc_parts, freq_parts = [], [], []
+        data_parts, start_parts, length_parts = [], [], []
+        doc_base = byte_base = 0
+
+        for segment, keep in zip(segments, keeps):
+            new_ids = (np.cumsum(keep) - 1 + doc_base).astype(np.int32)
+            term_map = np.array([terms.setdefault(term, len(terms)) for term in segment.term_names],
+                                dtype=np.int32)
+
+            docs, freqs = segment.flat_postings()
+            alive = keep[docs]
+            term_parts.append(term_map[np.repeat(np.arange(len(segment)), segment.doc_freqs)][alive])
+            doc_parts.append(new_ids[docs[alive]])
+            freq_parts.append(freqs[alive])
+
+            if positional:
+                data_parts.append(segment.positions_data)
+                start_parts.append(segment.position_offsets[:-1][alive] + byte_base)
+                length_parts.append(np.diff(segment.position_offsets)[alive])
+                byte_base += len(segment.positions_data)
+
+            doc_names.extend(doc for doc, k in zip(segment.doc_names, keep.tolist()) if k)
+            doc_lengths.append(segment.doc_lengths[keep])
+            doc_base += int(keep.sum())
+
+        term_names = list(terms)
+        term_column = np.concatenate(term_parts or [EMPTY]).astype(np.int32)
+
+        # Drop terms whose every posting was deleted
+        used = np.bincount(term_column, minlength=len(term_names)) > 0
+        if not used.all():
+            term_column = (np.cumsum(used) - 1)[term_column].astype(np.int32)
+            term_names = [term for term, u in zip(term_names, used.tolist()) if u]
+
+        positions = None
+        if positional:
+            positions = (b"".join(data_parts), np.concatenate(start_parts or [EMPTY]),
+                         np.concatenate(length_parts or [EMPTY]))
+
+        merged = InvertedIndex(analyzer=analyzers.pop() if analyzers else None)
+        merged.doc_names = doc_names
+        merged.doc_ids = {doc: i for i, doc in enumerate(doc_names)}
+        merged.doc_lengths = np.concatenate(doc_lengths or [EMPTY]).astype(np.int32)
+        merged._assemble(term_names, term_column, np.concatenate(doc_parts or [EMPTY]).astype(np.int32),
+                         np.concatenate(freq_parts or [EMPTY]).astype(np.int32), positions)
+        return merged
+
+    def merge(self, segment: "InvertedIndex", deleted=()) -> "InvertedIndex":
+        '''
+        A new index holding this index's documents, minus `deleted` and any
+        that `segment` replaces, followed by every document of `segment`
+        '''
+        merged = InvertedIndex.concatenate([self, segment], deleted)
+        merged.version = self.version + 1
+
+        if self.compressed is not None:
+            merged.compress()
+        return merged
+
+    @staticmethod
+    def _positions_of(tokens: list[str]) -> dict[str, list[int]]:
+        positions = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, []).append(position)
+        return positions
+
+    @property
+    def positional(self) -> bool:
+        return self.positions_data is not None
+
+    def positions(self, term: str, doc_id: int) -> np.ndarray:
+        '''
+        Sorted positions of `term` in one document, empty when it does not occur
+        '''
+        term_id = self.terms.get(term)
+        if term_id is None or not self.positional:
+            return EMPTY
+
+        doc_ids, _ = self.postings(term)
+        i = np.searchsorted(doc_ids, doc_id)
+        if i == len(doc_ids) or doc_ids[i] != doc_id:
+            return EMPTY
+
+        slot = self.offsets[term_id] + i
+        start, end = self.position_offsets[slot], self.position_offsets[slot + 1]
+        return np.cumsum(varint_decode(self.positions_data[start:end]))
+
+    def term_positions(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Every occurrence of `term` as flat (doc_ids, positions) arrays,
+        sorted by document then position, decoded in one pass
+        '''
+        term_id = self.terms.get(term)
+        if term_id is None or not self.positional:
+            return EMPTY, EMPTY
+
+        doc_ids, freqs = self.postings(term)
+        first, last = self.offsets[term_id], self.offsets[term_id + 1]
+        gaps = varint_decode(self.positions_data[self.position_offsets[first]:self.position_offsets[last]])
+
+        # Gaps restart at every posting, so undo the running sum at each boundary
+        running = np.cumsum(gaps)
+        starts = np.concatenate(([0], np.cumsum(freqs)[:-1]))
+        base = np.repeat(running[starts] - gaps[starts], freqs)
+
+        return np.repeat(doc_ids, freqs), running - base
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.terms
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_names)
+
+    @property
+    def avg_doc_length(self) -> float:
+        return float(self.doc_lengths.mean()) if len(self.doc_lengths) else 0.0
+
+    def doc_freq(self, term: str) -> int:
+        term_id = self.terms.get(term)
+        return 0 if term_id is None else int(self.doc_freqs[term_id])
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Returns (doc_ids, freqs) for `term`, both empty when it is not indexed
+        '''
+        term_id = self.terms.get(term)
+        if term_id is None:
+            return EMPTY, EMPTY
+
+        if self.compressed is not None:
+            return self._decode(term_id)
+
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.postings_docs[start:end], self.postings_freqs[start:end]
+
+    def flat_postings(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Every posting as flat (doc_ids, freqs) arrays laid out by `offsets`
+        '''
+        if self.compressed is None:
+            return self.postings_docs, self.postings_freqs
+
+        decoded = [self._decode(term_id) for term_id in range(len(self))]
+        return (np.concatenate([docs for docs, _ in decoded] or [EMPTY]),
+                np.concatenate([freqs for _, freqs in decoded] or [EMPTY]))
+
+    def bm25_weights(self, k1: float, b: float) -> np.ndarray:
+        '''
+        BM25 contribution of every posting, laid out like `flat_postings`
+        '''
+        docs, freqs = self.flat_postings()
+        norm = k1 * (1 - b + b * self.doc_lengths / self.avg_doc_length)
+        idf = np.log((self.num_docs - self.doc_freqs + 0.5) / (self.doc_freqs + 0.5) + 1)
+        term_of = np.repeat(np.arange(len(self)), self.doc_freqs)
+
+        return idf[term_of] * (freqs * (k1 + 1) / (freqs + norm[docs]))
+
+    def compress(self):
+        '''
+        Replaces the flat postings arrays with delta+varint encoded bytes.
+        Each term's doc ids restart from a full id, so terms decode independently.
+        '''
+        if self.compressed is not None:
+            return
+
+        gaps = self.postings_docs.astype(np.int64)
+        gaps[1:] -= self.postings_docs[:-1]
+        term_starts = self.offsets[:-1][self.doc_freqs > 0]
+        gaps[term_starts] = self.postings_docs[term_starts]
+
+        self.compressed = {}
+        for name, values in (("docs", gaps), ("freqs", self.postings_freqs)):
+            lengths = np.concatenate(([0], np.cumsum(varint_lengths(values))))
+            self.compressed[name] = (varint_encode(values), lengths[self.offsets])
+
+        self.postings_docs = self.postings_freqs = None
+
+    def _decode(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        decoded = []
+        for name in ("docs", "freqs"):
+            data, byte_offsets = self.compressed[name]
+            decoded.append(varint_decode(data[byte_offsets[term_id]:byte_offsets[term_id + 1]]))
+
+        doc_gaps, freqs = decoded
+        return np.cumsum(doc_gaps).astype(np.int32), freqs.astype(np.int32)
+
+    def memory_usage(self) -> int:
+        '''
+        Approximate bytes held by the index
+        '''
+        return deep_sizeof(self)
+
+class ImpactIndex:
+    '''
+    Impact-ordered BM25 postings for one fixed (k1, b).
+
+    Every posting's BM25 contribution is computed at build time and
+    quantized to an integer impact of `bits` bits, so scoring is integer
+    addition. Each term's postings are sorted by descending impact, which
+    lets `search` process the highest impacts of all terms first and stop
+    early. Exhaustive scoring is faster on this corpus, so `BM25` only
+    uses it when asked to.
+    '''
+    def __init__(self, index: InvertedIndex, k1: float = 1.5, b: float = 0.75, bits: int = 8):
+        self.k1 = k1
+        self.b = b
+        self.bits = bits
+        self.terms = index.terms
+        self.doc_names = index.doc_names
+        self.offsets = index.offsets
+
+        docs, _ = index.flat_postings()
+        weights = index.bm25_weights(k1, b)
+
+        levels = (1 << bits) - 1
+        self.scale = weights.max() / levels if len(weights) else 1.0
+        impacts = np.clip(np.rint(weights / self.scale), 1, levels).astype(np.uint16)
+
+        # Sort postings by (term, impact descending, doc id)
+        term_of = np.repeat(np.arange(len(index)), index.doc_freqs)
+        order = np.lexsort((docs, -impacts.astype(np.int32), term_of))
+        self.docs = docs[order]
+        self.impacts = impacts[order]
+
+    def search(self, query_terms: list[str], k: int, postings_budget: int = None) -> list[tuple[str, float]]:
+        '''
+        Score-at-a-time top-k over `query_terms` (repeats count repeatedly).
+
+        Postings are taken in bands of contribution, halving the threshold
+        each time, and each band of a term is added in one step. After a
+        band the search stops if the remaining impacts can no longer change
+        the top-k set (results are then exact under the quantized impacts)
+        or once `postings_budget` postings have been read (approximate, and
+        checked per band, so at least the first band is always read).
+        '''
+        weights = Counter(term for term in query_terms if term in self.terms)
+
+        # Per term: repeat count, first posting and negated impacts, ascending
+        spans = []
+        for term, weight in weights.items():
+            term_id = self.terms[term]
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            spans.append((weight, start, -self.impacts[start:end].astype(np.int32)))
+
+        scores = np.zeros(len(self.doc_names), dtype=np.int64)
+        read = [0] * len(spans)
+        self.last_postings_visited = 0
+
+        threshold = max((weight * -int(negated[0]) for weight, _, negated in spans), default=0)
+        while threshold > 0:
+            threshold >>= 1
+            bound = 0
+
+            for i, (weight, start, negated) in enumerate(spans):
+                # Postings whose contribution impact * weight exceeds the threshold
+                stop = int(np.searchsorted(negated, -(threshold // weight + 1), side="right"))
+                if stop > read[i]:
+                    postings = slice(start + read[i], start + stop)
+                    scores[self.docs[postings]] += self.impacts[postings] * weight
+                    self.last_postings_visited += stop - read[i]
+                    read[i] = stop
+                if stop < len(negated):
+                    bound -= int(negated[stop]) * weight
+
+            if bound == 0:
+                break
+            if postings_budget is not None and self.last_postings_visited >= postings_budget:
+                break
+            # The k-th score can only lead by `bound` if k documents already reach it
+            if k < len(scores) and np.count_nonzero(scores >= bound) >= k:
+                kth, next_best = -np.partition(-scores, (k - 1, k))[[k - 1, k]]
+                if kth >= next_best + bound:
+                    break
+
+        return [(self.doc_names[doc], float(scores[doc] * self.scale)) for doc in top_matches(scores, k)]
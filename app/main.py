@@ -32,8 +32,10 @@ from retrieval_models import VectorSpaceModel, BooleanIR
 # Swapping out CustomTKinter for TTKBootStrap
 from gui_ttkbs import IR_GUI
 
-app = IR_GUI(title = "Definitely Professional IR System",
-             themename = "darkly",
-             size = "820x720")
+# Index builds start worker processes, which re-import this module on spawn platforms
+if __name__ == "__main__":
+    app = IR_GUI(title = "Definitely Professional IR System",
+                 themename = "darkly",
+                 size = "820x720")
 
-app.mainloop()
+    app.mainloop()
@@ -0,0 +1,61 @@
+import os
+import math
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from corpus import Corpus, load_posts
+from inverted_index import InvertedIndex
+from preprocessing import preprocess_batch, ANALYZER
+
+# Worker processes used by the GUI; set FETCHER_BUILD_WORKERS=1 for a serial build
+BUILD_WORKERS = int(os.environ.get("FETCHER_BUILD_WORKERS", os.cpu_count() or 1))
+
+# Shards handed to each worker; several smaller shards even out posts of very different lengths
+SHARDS_PER_WORKER = 4
+
+def build_shard(names: list[str], texts: list[str], positional: bool = True, analyzer: str = ANALYZER):
+    '''
+    Worker side: preprocesses one shard of posts and indexes it as a segment.
+    Returns (token_lists, segment)
+    '''
+    token_lists = preprocess_batch(texts, analyzer=analyzer)
+    tokens = dict(zip(names, token_lists))
+
+    if positional:
+        return token_lists, InvertedIndex(tokens=tokens, analyzer=analyzer)
+    return token_lists, InvertedIndex({doc: Counter(doc_tokens) for doc, doc_tokens in tokens.items()},
+                                      analyzer=analyzer)
+
+def build_parallel(folder_path: str, workers: int = None, len_lim: int = None,
+                   positional: bool = True, analyzer: str = None) -> tuple[Corpus, InvertedIndex]:
+    '''
+    Loads the corpus and builds its inverted index across `workers` processes.
+
+    Posts are parsed once here, split into contiguous shards in corpus
+    order, and every worker lemmatizes and indexes its shards. The shard
+    segments are concatenated in the same order, so the result is
+    identical to `Corpus(folder_path)` followed by a serial `InvertedIndex`.
+    '''
+    workers = workers or os.cpu_count() or 1
+    analyzer = analyzer or ANALYZER
+    sources = {}
+    documents = load_posts(folder_path, len_lim, sources=sources)
+    names, texts = list(documents), list(documents.values())
+
+    shard_size = max(1, math.ceil(len(names) / (workers * SHARDS_PER_WORKER)))
+    starts = range(0, len(names), shard_size)
+
+    print(f"[CORPUS] Preprocessing {len(names)} posts in {len(starts)} shards on {workers} processes")
+    # Spawned rather than forked: a fork would copy locks held by other
+    # threads (e.g. the GUI's analyzer warm-up) into workers that then wait on them forever
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        shards = list(pool.map(build_shard, [names[i:i + shard_size] for i in starts],
+                               [texts[i:i + shard_size] for i in starts], [positional] * len(starts),
+                               [analyzer] * len(starts)))
+
+    corpus = Corpus.from_tokens(folder_path, documents,
+                                [tokens for token_lists, _ in shards for tokens in token_lists],
+                                sources, len_lim, analyzer)
+    index = InvertedIndex.concatenate([segment for _, segment in shards])
+
+    return corpus, index
@@ -0,0 +1,222 @@
+import numpy as np
+from inverted_index import InvertedIndex, EMPTY
+
+# Terms found in at least this fraction of documents are held as bitmaps
+DENSE_RATIO = 1 / 32
+
+class Postings:
+    '''
+    A set of doc ids, held as a sorted int32 array or as a boolean bitmap.
+    `negated` marks the complement, which is kept lazy so that NOT can be
+    folded into AND-NOT instead of materializing every document.
+    '''
+    __slots__ = ("ids", "bitmap", "negated")
+
+    def __init__(self, ids: np.ndarray = None, bitmap: np.ndarray = None, negated: bool = False):
+        self.ids = ids
+        self.bitmap = bitmap
+        self.negated = negated
+
+    def __len__(self):
+        return len(self.ids) if self.ids is not None else int(self.bitmap.sum())
+
+    def positive(self) -> "Postings":
+        return Postings(self.ids, self.bitmap)
+
+def gallop_contains(haystack: np.ndarray, needles: np.ndarray) -> np.ndarray:
+    '''
+    Boolean mask of which sorted `needles` occur in sorted `haystack`,
+    by binary-searching each needle (the larger the size ratio, the bigger the win)
+    '''
+    if not len(haystack):
+        return np.zeros(len(needles), dtype=bool)
+
+    positions = np.searchsorted(haystack, needles)
+    positions[positions == len(haystack)] = len(haystack) - 1
+    return haystack[positions] == needles
+
+def intersect(small: np.ndarray, large: np.ndarray) -> np.ndarray:
+    '''
+    Sorted intersection; binary search from the shorter list into the
+    longer one when sizes are skewed, a linear merge otherwise
+    '''
+    if len(small) > len(large):
+        small, large = large, small
+    if not len(small):
+        return EMPTY
+
+    if len(large) > 8 * len(small):
+        return small[gallop_contains(large, small)]
+    return np.intersect1d(small, large, assume_unique=True)
+
+def min_distance(left: np.ndarray, right: np.ndarray) -> int:
+    '''
+    Smallest gap between a position in `left` and one in `right` (both sorted)
+    '''
+    if not len(left) or not len(right):
+        return np.iinfo(np.int64).max
+
+    i = np.searchsorted(right, left)
+    after = right[np.minimum(i, len(right) - 1)]
+    before = right[np.maximum(i - 1, 0)]
+    return int(np.minimum(np.abs(after - left), np.abs(left - before)).min())
+
+class PostingAlgebra:
+    '''
+    Boolean operators over the postings of an `InvertedIndex`
+    '''
+    def __init__(self, index: InvertedIndex, dense_ratio: float = DENSE_RATIO):
+        self.index = index
+        self.num_docs = index.num_docs
+        self.dense_threshold = max(1, int(self.num_docs * dense_ratio))
+        self._bitmaps = {}
+
+    def _bitmap(self, ids: np.ndarray) -> np.ndarray:
+        bitmap = np.zeros(self.num_docs, dtype=bool)
+        bitmap[ids] = True
+        return bitmap
+
+    def term(self, term: str) -> Postings:
+        '''
+        Postings of one term; dense terms come back as (cached) bitmaps
+        '''
+        if term in self._bitmaps:
+            return Postings(bitmap=self._bitmaps[term])
+
+        doc_ids, _ = self.index.postings(term)
+        if len(doc_ids) >= self.dense_threshold:
+            self._bitmaps[term] = self._bitmap(doc_ids)
+            return Postings(bitmap=self._bitmaps[term])
+
+        return Postings(ids=doc_ids)
+
+    def not_(self, operand: Postings) -> Postings:
+        return Postings(operand.ids, operand.bitmap, not operand.negated)
+
+    def and_(self, operands: list[Postings]) -> Postings:
+        '''
+        Intersection in ascending size order; negated operands are
+        applied last as AND-NOT filters on the (already small) result
+        '''
+        positives = sorted((p for p in operands if not p.negated), key=len)
+        negatives = [p.positive() for p in operands if p.negated]
+
+        if not positives:
+            return self.not_(self.or_(negatives))
+
+        lists = [p.ids for p in positives if p.ids is not None]
+        bitmaps = [p.bitmap for p in positives if p.bitmap is not None]
+
+        if not lists:
+            result = np.logical_and.reduce(bitmaps)
+            for negative in negatives:
+                result = result & ~(negative.bitmap if negative.bitmap is not None
+                                    else self._bitmap(negative.ids))
+            return Postings(bitmap=result)
+
+        result = lists[0]
+        for other in lists[1:]:
+            if not len(result):
+                break
+            result = intersect(result, other)
+        for bitmap in bitmaps:
+            result = result[bitmap[result]]
+
+        for negative in negatives:
+            if not len(result):
+                break
+            if negative.bitmap is not None:
+                result = result[~negative.bitmap[result]]
+            else:
+                result = result[~gallop_contains(negative.ids, result)]
+
+        return Postings(ids=result)
+
+    def or_(self, operands: list[Postings]) -> Postings:
+        '''
+        Union; with negated operands, OR(P, NOT N) = NOT(AND(N, NOT OR(P)))
+        '''
+        positives = [p for p in operands if not p.negated]
+        negatives = [p.positive() for p in operands if p.negated]
+
+        if negatives:
+            inner = negatives + ([self.not_(self.or_(positives))] if positives else [])
+            return self.not_(self.and_(inner))
+
+        if not positives:
+            return Postings(ids=EMPTY)
+        if len(positives) == 1:
+            return positives[0]
+
+        if sum(len(p) for p in positives) >= self.dense_threshold:
+            result = np.zeros(self.num_docs, dtype=bool)
+            for p in positives:
+                if p.bitmap is not None:
+                    result |= p.bitmap
+                else:
+                    result[p.ids] = True
+            return Postings(bitmap=result)
+
+        return Postings(ids=np.unique(np.concatenate([self.materialize(p) for p in positives])).astype(np.int32))
+
+    def _require_positions(self):
+        if not self.index.positional:
+            raise ValueError("Phrase and NEAR queries need a positional index")
+
+    def _occurrences(self, word: str, shift: int = 0) -> np.ndarray:
+        '''
+        Sorted int64 keys `doc_id << 32 | position - shift` of every occurrence of `word`
+        '''
+        doc_ids, positions = self.index.term_positions(word)
+        return (doc_ids.astype(np.int64) << 32) + positions - shift
+
+    def phrase(self, words: list[str]) -> Postings:
+        '''
+        Documents containing `words` at consecutive positions
+        '''
+        if len(words) == 1:
+            return self.term(words[0])
+        if not words:
+            return Postings(ids=EMPTY)
+        self._require_positions()
+
+        # Shifting word i back by i positions lines every phrase up on its start
+        order = sorted(range(len(words)), key=lambda i: self.index.doc_freq(words[i]))
+        starts = self._occurrences(words[order[0]], order[0])
+        for i in order[1:]:
+            if not len(starts):
+                break
+            starts = starts[gallop_contains(self._occurrences(words[i], i), starts)]
+
+        return Postings(ids=np.unique(starts >> 32).astype(np.int32))
+
+    def near(self, left: str, right: str, distance: int) -> Postings:
+        '''
+        Documents where `left` and `right` occur at most `distance` positions apart, in either order
+        '''
+        self._require_positions()
+
+        lefts, rights = self._occurrences(left), self._occurrences(right)
+        if not len(lefts) or not len(rights):
+            return Postings(ids=EMPTY)
+
+        # Nearest right-hand occurrence on either side of every left-hand one;
+        # keys of different documents are 2**32 apart so never come within range
+        i = np.searchsorted(rights, lefts)
+        after = rights[np.minimum(i, len(rights) - 1)]
+        before = rights[np.maximum(i - 1, 0)]
+        close = (np.abs(after - lefts) <= distance) | (np.abs(lefts - before) <= distance)
+
+        return Postings(ids=np.unique(lefts[close] >> 32).astype(np.int32))
+
+    def materialize(self, postings: Postings) -> np.ndarray:
+        '''
+        Sorted doc ids of the (possibly negated) result
+        '''
+        bitmap = postings.bitmap
+        if postings.negated:
+            bitmap = ~bitmap if bitmap is not None else ~self._bitmap(postings.ids)
+        elif bitmap is None:
+            return postings.ids
+
+        return np.flatnonzero(bitmap).astype(np.int32)
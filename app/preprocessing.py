@@ -1,10 +1,104 @@
+import os
 import re
-import nltk
-import spacy
+import atexit
+import pickle
+import threading
+from collections import OrderedDict
 
-stopwords = set(nltk.corpus.stopwords.words("english"))
+# Lemmatization only needs POS tags, so the parser and NER are never loaded
+LEMMA_EXCLUDE = ["parser", "ner", "senter"]
 
-lang_model = spacy.load("en_core_web_sm")
+# Texts are split into chunks of at most this many characters before going
+# through spaCy, keeping memory flat and staying well under `max_length`
+CHUNK_SIZE = 100_000
+
+# Bounds the lemma cache; newsgroup vocabulary comfortably fits in this
+LEMMA_CACHE_SIZE = 500_000
+LEMMA_CACHE_PATH = os.environ.get("FETCHER_LEMMA_CACHE")
+
+# "spacy" lemmatizes with en_core_web_sm; "fast" is a single-regex tokenizer
+# plus a Snowball stemmer. Indexes record the analyzer they were built with
+# and analyze their queries the same way, whatever this is set to later.
+ANALYZERS = ("spacy", "fast")
+ANALYZER = os.environ.get("FETCHER_ANALYZER", "spacy")
+
+# Fast analyzer, applied to lowercased text in one pass: a run ending in
+# `@` or `://` starts an email address or URL and is dropped up to the next
+# space; any other run of word characters, keeping inner apostrophes, is
+# captured as a token. Possessive quantifiers keep it from backtracking.
+FAST_TOKEN = re.compile(r"[\w.+-]++(?:@|://)\S*+|(\w++(?:'\w++)*+)")
+
+# spaCy, NLTK and their data are loaded on first use rather than at import,
+# which keeps importing this module cheap; `warm_up` loads them ahead of time
+_resources = {}
+_resource_locks = {"stopwords": threading.Lock(), "lang_model": threading.Lock(),
+                   "stemmer": threading.Lock()}
+
+def _load_once(name: str, loader):
+    resource = _resources.get(name)
+    if resource is None:
+        with _resource_locks[name]:
+            resource = _resources.get(name)
+            if resource is None:
+                resource = _resources[name] = loader()
+    return resource
+
+def _load_stopwords() -> set:
+    import nltk
+    return set(nltk.corpus.stopwords.words("english"))
+
+def _load_lang_model():
+    import spacy
+    return spacy.load("en_core_web_sm", exclude=LEMMA_EXCLUDE)
+
+def _load_stemmer():
+    from nltk.stem.snowball import SnowballStemmer
+    return SnowballStemmer("english")
+
+def get_stopwords() -> set:
+    return _load_once("stopwords", _load_stopwords)
+
+def get_lang_model():
+    return _load_once("lang_model", _load_lang_model)
+
+def get_stemmer():
+    return _load_once("stemmer", _load_stemmer)
+
+def warm_up(analyzer: str = None):
+    '''
+    Loads everything `analyzer` needs, so the first query does not pay for it
+    '''
+    get_stopwords()
+    if (analyzer or ANALYZER) == "fast":
+        get_stemmer()
+    else:
+        get_lang_model()
+
+def __getattr__(name: str):
+    # `stopwords` and `lang_model` were module globals loaded at import; they stay importable
+    if name == "stopwords":
+        return get_stopwords()
+    if name == "lang_model":
+        return get_lang_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class StemTable(dict):
+    '''
+    Surface token -> Snowball stem, or "" for tokens the fast analyzer drops.
+    Filled on first lookup and cleared when it outgrows `max_size`.
+    '''
+    def __init__(self, remove_stopwords: bool, max_size: int = LEMMA_CACHE_SIZE):
+        super().__init__()
+        self.remove_stopwords = remove_stopwords
+        self.max_size = max_size
+
+    def __missing__(self, word: str) -> str:
+        if len(self) >= self.max_size:
+            self.clear()
+
+        dropped = not word or (self.remove_stopwords and word in get_stopwords())
+        stem = self[word] = "" if dropped else get_stemmer().stem(word)
+        return stem
 
 def regex_text(text: str) -> str:
     '''
@@ -25,6 +119,14 @@ def regex_text(text: str) -> str:
         text = re.sub(pattern, replacement, text)
     return text
 
+def fast_tokens(text: str, remove_stopwords: bool = True) -> list[str]:
+    '''
+    The fast analyzer: lowercase, strip URLs and emails, split, drop stopwords and stem
+    '''
+    stems = stem_tables[remove_stopwords]
+    return [stem for stem in map(stems.__getitem__, FAST_TOKEN.findall(text.lower().replace("’", "'")))
+            if stem]
+
 def stopword_removal(text: str, stopwords_set: set) -> str:
     words = text.split()
     return " ".join([word for word in words if word not in stopwords_set])
@@ -34,10 +136,161 @@ def lemma(tokens, language_model):
 
     return [token.lemma_ for token in doc]
 
-def preprocess(text: str, remove_stopwords: bool = True) -> list[str]:
-    text = regex_text(text)
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE):
+    '''
+    Splits cleaned text into whitespace-aligned chunks of at most `chunk_size` characters
+    '''
+    start = 0
+
+    while len(text) - start > chunk_size:
+        end = text.rfind(" ", start, start + chunk_size + 1)
+        if end <= start:
+            end = start + chunk_size
+        yield text[start:end]
+        # Only a space at the cut is dropped; a hard cut inside a word keeps every character
+        start = end + 1 if text[end] == " " else end
+
+    if start < len(text):
+        yield text[start:]
+
+def lemma_batch(texts: list[str], language_model, batch_size: int = 64,
+                n_process: int = 1, chunk_size: int = CHUNK_SIZE) -> list[list[str]]:
+    '''
+    Lemmatizes many cleaned texts with a single `nlp.pipe` stream
+    '''
+    chunk_size = min(chunk_size, language_model.max_length - 1)
+    lemmas = [[] for _ in texts]
+
+    chunks = ((chunk, i) for i, text in enumerate(texts)
+              for chunk in chunk_text(text, chunk_size))
+
+    for doc, i in language_model.pipe(chunks, as_tuples=True,
+                                      batch_size=batch_size, n_process=n_process):
+        lemmas[i].extend(token.lemma_ for token in doc)
+
+    return lemmas
+
+class LemmaCache:
+    '''
+    LRU cache of surface token -> lemmas, shared by every caller of `preprocess`.
+
+    Tokens are lemmatized on their own the first time they are seen, so a
+    surface form always maps to the same lemmas regardless of context.
+    Lemmas are stored as tuples since spaCy can split one surface token
+    (e.g. "isn't") into several.
+    '''
+    def __init__(self, max_size: int = LEMMA_CACHE_SIZE, path: str = None):
+        self.max_size = max_size
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path:
+            self.load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _put(self, word: str, lemmas: tuple[str, ...]):
+        self._entries[word] = lemmas
+        self._entries.move_to_end(word)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def lemmatize_batch(self, word_lists: list[list[str]], language_model,
+                        batch_size: int = 1000, n_process: int = 1) -> list[list[str]]:
+        '''
+        Lemmatizes lists of surface tokens, sending only unseen tokens to spaCy
+        '''
+        resolved = {}
+        missing = []
+
+        with self._lock:
+            for words in word_lists:
+                for word in words:
+                    if word in resolved:
+                        self.hits += 1
+                        continue
+
+                    lemmas = self._entries.get(word)
+                    if lemmas is None:
+                        self.misses += 1
+                        missing.append(word)
+                    else:
+                        self.hits += 1
+                        self._entries.move_to_end(word)
+                    resolved[word] = lemmas
+
+        if missing:
+            new_lemmas = lemma_batch(missing, language_model, batch_size, n_process)
+
+            with self._lock:
+                for word, lemmas in zip(missing, new_lemmas):
+                    resolved[word] = tuple(lemmas)
+                    self._put(word, resolved[word])
+
+        return [[lemma for word in words for lemma in resolved[word]] for words in word_lists]
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                entries = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return
+
+        with self._lock:
+            for word, lemmas in entries:
+                self._put(word, lemmas)
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            entries = list(self._entries.items())
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path + ".tmp", 'wb') as f:
+            pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(self.path + ".tmp", self.path)
+
+lemma_cache = LemmaCache(path=LEMMA_CACHE_PATH)
+atexit.register(lemma_cache.save)
+
+# Keyed on `remove_stopwords`
+stem_tables = {True: StemTable(True), False: StemTable(False)}
+
+def preprocess_batch(texts: list[str], remove_stopwords: bool = True,
+                     batch_size: int = 64, n_process: int = 1, analyzer: str = None) -> list[list[str]]:
+    '''
+    Batched equivalent of `preprocess`, one token list per text
+    '''
+    analyzer = analyzer or ANALYZER
+    if analyzer == "fast":
+        return [fast_tokens(text, remove_stopwords) for text in texts]
+    if analyzer != "spacy":
+        raise ValueError(f"Unknown analyzer '{analyzer}', expected one of {', '.join(ANALYZERS)}")
+
+    cleaned = [regex_text(text) for text in texts]
 
     if remove_stopwords == True:
-        stopword_removal(text, stopwords)
+        cleaned = [stopword_removal(text, get_stopwords()) for text in cleaned]
+
+    return lemma_cache.lemmatize_batch([text.split() for text in cleaned], get_lang_model(),
+                                       batch_size * 16, n_process)
 
-    return lemma(text , lang_model)
+def preprocess(text: str, remove_stopwords: bool = True, analyzer: str = None) -> list[str]:
+    return preprocess_batch([text], remove_stopwords, analyzer=analyzer)[0]
@@ -0,0 +1,252 @@
+import re
+import threading
+from collections import OrderedDict
+from inverted_index import InvertedIndex
+from postings import PostingAlgebra, Postings
+
+TOKEN_PATTERN = re.compile(r'"[^"]*"|\bNEAR/\d+\b|\bNOT\b|\bAND\b|\bOR\b|\(|\)|\w+', re.IGNORECASE)
+NEAR_PATTERN = re.compile(r"NEAR/(\d+)")
+OPERATORS = {"NOT", "AND", "OR"}
+
+PLAN_CACHE_SIZE = 1024
+
+# AST nodes are tuples: ("term", word), ("phrase", (words)), ("near", left, right, k),
+# ("not", node), ("and", [nodes]), ("or", [nodes])
+LEAVES = ("term", "phrase", "near")
+
+def tokenize(query: str) -> list[str]:
+    '''
+    Operators are matched case-insensitively and upper-cased; terms are lower-cased
+    '''
+    return [token.upper() if token.upper() in OPERATORS or NEAR_PATTERN.fullmatch(token.upper())
+            else token.lower()
+            for token in TOKEN_PATTERN.findall(query)]
+
+class _Parser:
+    '''
+    Recursive descent over:
+        or   := and (OR and)*
+        and  := not ([AND] not)*      -- adjacent terms are implicitly ANDed
+        not  := NOT not | near
+        near := atom (NEAR/k atom)*    -- chains become an AND of adjacent pairs
+        atom := term | "phrase" | "(" or ")"
+
+    Terms and phrase text go through `analyzer` so they match the indexed
+    tokens. Words it drops, like stopwords, leave the query: the parse
+    methods return None for an operand with nothing left, and operators
+    skip such operands.
+    '''
+    def __init__(self, tokens: list[str], analyzer=None):
+        self.tokens = tokens
+        self.analyzer = analyzer or str.split
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise ValueError("Empty boolean query")
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected '{self.peek()}' in boolean query")
+        if node is None:
+            raise ValueError("Boolean query has no searchable terms")
+        return node
+
+    def parse_or(self):
+        operands = [self.parse_and()]
+        while self.peek() == "OR":
+            self.take()
+            operands.append(self.parse_and())
+        return _join("or", operands)
+
+    def parse_and(self):
+        operands = [self.parse_not()]
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.take()
+            operands.append(self.parse_not())
+        return _join("and", operands)
+
+    def parse_not(self):
+        if self.peek() == "NOT":
+            self.take()
+            node = self.parse_not()
+            return None if node is None else ("not", node)
+        return self.parse_near()
+
+    def parse_near(self):
+        operands = [self.parse_atom()]
+        distances = []
+        while self.peek() and NEAR_PATTERN.fullmatch(self.peek()):
+            distances.append(int(NEAR_PATTERN.fullmatch(self.take()).group(1)))
+            operands.append(self.parse_atom())
+
+        if not distances:
+            return operands[0]
+
+        # A dropped word takes no position in the index, so the words on
+        # either side of it are joined with their distances added up
+        kept, gaps, pending = [], [], 0
+        for operand, k in zip(operands, [0] + distances):
+            pending += k
+            if operand is None:
+                continue
+            if kept:
+                gaps.append(pending)
+            kept.append(operand)
+            pending = 0
+
+        operands, distances = kept, gaps
+        if len(operands) <= 1:
+            return operands[0] if operands else None
+        if any(operand[0] != "term" for operand in operands):
+            raise ValueError("NEAR/k only joins single terms")
+
+        pairs = [("near", left[1], right[1], k)
+                 for left, right, k in zip(operands, operands[1:], distances)]
+        return pairs[0] if len(pairs) == 1 else ("and", pairs)
+
+    def parse_atom(self):
+        token = self.take()
+        if token == "(":
+            node = self.parse_or()
+            if self.take() != ")":
+                raise ValueError("Unbalanced parentheses in boolean query")
+            return node
+        if token is None or token in OPERATORS or token == ")" or NEAR_PATTERN.fullmatch(token):
+            raise ValueError(f"Expected a term but found '{token or 'end of query'}'")
+        words = tuple(self.analyzer(token.strip('"')))
+        if not words:
+            return None
+        return ("term", words[0]) if len(words) == 1 else ("phrase", words)
+
+def _join(kind: str, operands: list):
+    operands = [operand for operand in operands if operand is not None]
+    if not operands:
+        return None
+    return operands[0] if len(operands) == 1 else (kind, operands)
+
+def parse(query: str, analyzer=None):
+    return _Parser(tokenize(query), analyzer).parse()
+
+def normalize(node, negate: bool = False):
+    '''
+    Pushes NOT down to the terms with De Morgan's laws, then flattens
+    nested ANDs/ORs and drops duplicate operands
+    '''
+    kind = node[0]
+
+    if kind in LEAVES:
+        return ("not", node) if negate else node
+    if kind == "not":
+        return normalize(node[1], not negate)
+
+    if negate:
+        kind = "or" if kind == "and" else "and"
+
+    operands = []
+    for child in node[1]:
+        child = normalize(child, negate)
+        for operand in (child[1] if child[0] == kind else [child]):
+            if operand not in operands:
+                operands.append(operand)
+
+    return operands[0] if len(operands) == 1 else (kind, operands)
+
+def to_string(node) -> str:
+    kind = node[0]
+    if kind == "term":
+        return node[1]
+    if kind == "phrase":
+        return '"' + " ".join(node[1]) + '"'
+    if kind == "near":
+        return f"{node[1]} NEAR/{node[3]} {node[2]}"
+    if kind == "not":
+        return f"NOT {to_string(node[1])}"
+    return "(" + f" {kind.upper()} ".join(to_string(child) for child in node[1]) + ")"
+
+class QueryCompiler:
+    '''
+    Parses, normalizes and cost-orders boolean queries against one index,
+    caching the compiled plans by normalized query string
+    '''
+    def __init__(self, index: InvertedIndex, cache_size: int = PLAN_CACHE_SIZE, analyzer=None):
+        self.index = index
+        self.analyzer = analyzer
+        self.cache_size = cache_size
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def estimate(self, node) -> int:
+        '''
+        Upper estimate of a node's result size from document frequencies
+        '''
+        kind = node[0]
+        if kind == "term":
+            return self.index.doc_freq(node[1])
+        if kind == "phrase":
+            return min((self.index.doc_freq(word) for word in node[1]), default=0)
+        if kind == "near":
+            return min(self.index.doc_freq(node[1]), self.index.doc_freq(node[2]))
+        if kind == "not":
+            return self.index.num_docs - self.estimate(node[1])
+        sizes = [self.estimate(child) for child in node[1]]
+        return min(sizes) if kind == "and" else min(self.index.num_docs, sum(sizes))
+
+    def plan(self, node):
+        '''
+        Orders every AND/OR's operands by ascending estimated postings size,
+        keeping negations after the positive operands of an AND
+        '''
+        kind = node[0]
+        if kind in LEAVES:
+            return node
+        if kind == "not":
+            return ("not", self.plan(node[1]))
+
+        operands = [self.plan(child) for child in node[1]]
+        operands.sort(key=lambda child: (kind == "and" and child[0] == "not", self.estimate(child)))
+        return (kind, operands)
+
+    def compile(self, query: str):
+        key = " ".join(query.lower().split())
+
+        with self._lock:
+            plan = self._plans.get(key)
+            if plan is not None:
+                self._plans.move_to_end(key)
+                return plan
+
+        plan = self.plan(normalize(parse(query, self.analyzer)))
+
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.cache_size:
+                self._plans.popitem(last=False)
+
+        return plan
+
+    def clear(self):
+        with self._lock:
+            self._plans.clear()
+
+def evaluate(plan, algebra: PostingAlgebra) -> Postings:
+    kind = plan[0]
+    if kind == "term":
+        return algebra.term(plan[1])
+    if kind == "phrase":
+        return algebra.phrase(list(plan[1]))
+    if kind == "near":
+        return algebra.near(plan[1], plan[2], plan[3])
+    if kind == "not":
+        return algebra.not_(evaluate(plan[1], algebra))
+
+    operands = [evaluate(child, algebra) for child in plan[1]]
+    return algebra.and_(operands) if kind == "and" else algebra.or_(operands)
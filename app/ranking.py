@@ -0,0 +1,102 @@
+import heapq
+import bisect
+import itertools
+import numpy as np
+
+def top_k(scores: np.ndarray, k: int = None) -> np.ndarray:
+    '''
+    Indices of the `k` highest scores, best first; ties keep index order.
+    Uses `argpartition`, so only the selected scores get sorted.
+    '''
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    selected = np.argpartition(-scores, k - 1)[:k]
+    # The partition boundary may split a tie, so pull in every index
+    # scoring exactly the k-th best and let the stable sort decide
+    threshold = scores[selected].min()
+    selected = np.union1d(np.flatnonzero(scores > threshold), np.flatnonzero(scores == threshold))
+    order = np.argsort(-scores[selected], kind="stable")
+
+    return selected[order][:k]
+
+def top_matches(scores: np.ndarray, k: int = None) -> np.ndarray:
+    '''
+    `top_k` over the positive scores only, i.e. the documents matching the
+    query, so exhaustive results agree with pruned ones that never see the rest
+    '''
+    selected = top_k(scores, k)
+    return selected[:np.count_nonzero(scores[selected] > 0)]
+
+def max_score(postings: list[tuple[list[int], list[float], float]], k: int) -> tuple[list[tuple[int, float]], int]:
+    '''
+    MaxScore document-at-a-time top-k over per-term (doc_ids, weights,
+    upper_bound) lists, each sorted by doc id.
+
+    Terms are ordered by upper bound; the lowest-bound terms whose bounds
+    sum to no more than the current k-th best score are "non-essential":
+    a document is only considered when an essential term contains it, and
+    non-essential terms are probed (by binary search) only while they can
+    still lift it into the top-k.
+
+    Returns ([(doc_id, score)] best first, postings visited).
+    '''
+    postings = sorted((p for p in postings if len(p[0])), key=lambda p: p[2])
+    if not postings or k <= 0:
+        return [], 0
+
+    lists = [(doc_ids, weights) for doc_ids, weights, _ in postings]
+    prefix = list(itertools.accumulate(bound for _, _, bound in postings))  # bound of lists[0..i]
+    cursors = [0] * len(lists)
+
+    heap = []          # (score, -doc) min-heap of the current top-k
+    threshold = 0.0
+    first_essential = 0
+    visited = 0
+
+    while True:
+        # The next candidate is the smallest doc id under an essential cursor
+        candidate = min((lists[i][0][cursors[i]] for i in range(first_essential, len(lists))
+                         if cursors[i] < len(lists[i][0])), default=None)
+        if candidate is None:
+            break
+
+        score = 0.0
+        for i in range(first_essential, len(lists)):
+            doc_ids, weights = lists[i]
+            if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == candidate:
+                score += weights[cursors[i]]
+                cursors[i] += 1
+                visited += 1
+
+        for i in range(first_essential - 1, -1, -1):
+            if score + prefix[i] <= threshold:
+                break
+            doc_ids, weights = lists[i]
+            cursors[i] = bisect.bisect_left(doc_ids, candidate, cursors[i])
+            visited += 1
+            if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == candidate:
+                score += weights[cursors[i]]
+
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -candidate))
+        elif score > threshold:
+            heapq.heapreplace(heap, (score, -candidate))
+
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while first_essential < len(lists) and prefix[first_essential] <= threshold:
+                first_essential += 1
+
+    results = sorted(((-neg_doc, score) for score, neg_doc in heap), key=lambda item: (-item[1], item[0]))
+    return results, visited
+
+def merge_top_k(result_lists: list[list[tuple[str, float]]], k: int = None) -> list[tuple[str, float]]:
+    '''
+    Merges per-shard (doc, score) lists, each sorted best first, into the
+    overall top `k` with a heap; ties keep shard order, then list order
+    '''
+    merged = heapq.merge(*result_lists, key=lambda item: -item[1])
+    return list(itertools.islice(merged, k))
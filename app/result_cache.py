@@ -0,0 +1,106 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from inverted_index import deep_sizeof
+from preprocessing import preprocess
+
+RESULT_CACHE_SIZE = 4096
+RESULT_CACHE_TTL = float(os.environ.get("FETCHER_RESULT_TTL", 600))
+RESULT_CACHE_BYTES = 64 << 20
+
+MISSING = object()
+
+def query_key(model_name: str, model, query: str, k: int = None, **params) -> tuple:
+    '''
+    (model, normalized query, k, params, index version). Ranked queries are
+    normalized to their preprocessed terms, boolean ones to their compiled
+    plan, so different spellings of one query share an entry. The index
+    version changes on every rebuild and update, so stale entries never hit.
+    '''
+    normalized = model.explain(query) if model_name == "bool" \
+        else " ".join(preprocess(query, analyzer=model.analyzer))
+    return model_name, normalized, k, tuple(sorted(params.items())), model.index_version
+
+class ResultCache:
+    '''
+    LRU cache of search results with a time-to-live and a cap on the
+    approximate bytes held, shared by every search front end
+    '''
+    def __init__(self, max_entries: int = RESULT_CACHE_SIZE, ttl: float = RESULT_CACHE_TTL,
+                 max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()   # key -> (value, expires_at, size, cost)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        _, _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry[3]
+            return entry[0]
+
+    def put(self, key, value, cost: float = 0.0):
+        '''
+        Stores `value`; `cost` is the seconds it took to compute, credited on every later hit
+        '''
+        size = deep_sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, size, cost)
+            self.bytes += size
+
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, MISSING)
+        if value is MISSING:
+            started = time.perf_counter()
+            value = compute()
+            self.put(key, value, time.perf_counter() - started)
+        return value
+
+    def stats(self) -> dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "bytes": self.bytes, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions, "expirations": self.expirations,
+                "saved_seconds": self.saved_seconds}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+result_cache = ResultCache()
@@ -1,232 +1,472 @@
-import re
-import os
-import glob
 import math
+import uuid
+import numpy as np
 import tfidf_fn as idf_fns
 from typing import List, Dict
-from preprocessing import preprocess
-from collections import Counter, OrderedDict, defaultdict
+from corpus import Corpus
+from ranking import top_k, top_matches, max_score
+from postings import PostingAlgebra, min_distance
+from query_compiler import QueryCompiler, evaluate, to_string
+from inverted_index import InvertedIndex, ImpactIndex
+from preprocessing import preprocess, preprocess_batch
+from index_file import open_index_file
+from scipy.sparse import csr_matrix, csc_matrix
+from parallel_build import build_parallel, BUILD_WORKERS
+from index_store import IndexStore
+from index_writer import sync_models
+from functools import partial
+from collections import Counter, OrderedDict
 
 class VectorSpaceModel():
-    def __init__(self, folder_path: str):
-        self.path = folder_path
-        self.docs = self._doc_to_dict(folder_path)
-        self.tf_idf_scores, self.custom_vectorizer = idf_fns.sklearn_tfidf(self.docs)
-
-    def return_top_n(self, query: str, n: int):
-        tfidf_query = idf_fns.sklearn_tfidif_query(query, self.custom_vectorizer)
-        results = idf_fns.sklearn_cos_sim(tfidf_query, self.tf_idf_scores, self.docs)
-
-        return results[:n]
-
-    def _doc_to_dict(self, path: str, len_lim: int = 100_000):
+    # Analyzer of the indexed tokens, applied to queries; None for the default
+    analyzer = None
+
+    def __init__(self, folder_path: str = None, corpus: Corpus = None, index: InvertedIndex = None,
+                 tf: str = "raw", idf: str = "smooth"):
+        self.corpus = corpus if corpus is not None else Corpus(folder_path)
+        self.path = self.corpus.folder_path
+        self.docs = self.corpus.documents
+        self.tf = tf
+        self.idf = idf
+        self.refresh(index)
+
+    @classmethod
+    def from_index_file(cls, path: str) -> "VectorSpaceModel":
         '''
-        Returns dictionary with: Doc_name -> Content_String
+        Opens the TF-IDF matrix of an index file written by `write_index_file`
         '''
-        name_content = {}
-
-        file_names = glob.glob(path)
-
-        for file in file_names:
-            name = os.path.basename(file)  # Extracts the file name with dots intact
-            print(f"[VSM] Now Loading: \'{name}\', into memory")
-
-            with open(file, 'r') as f:
-                if len_lim:
-                    data = f.read(len_lim)
-                else:
-                    data = f.read()
-            name_content[name] = data
-
-        return name_content
-
-class BooleanIR:
-    def __init__(self, folder_path):
-        self.folder_path = folder_path
-        self.documents = self._load_documents()
-        self.processed_docs = self._doc_processor(self.documents)
-        self.inverted_index = self._create_inverted_index()
-
-    def _load_documents(self, len_lim: int = 100_000):
+        index_file = open_index_file(path)
+        if "vsm_data" not in index_file:
+            raise ValueError(f"'{path}' holds no TF-IDF matrix")
+
+        model = cls.__new__(cls)
+        model.corpus = model.docs = None
+        model.path = index_file.folder_path
+        model.analyzer = index_file.header["analyzer"]
+        model.doc_names = index_file.strings("docs")
+        model.index_version = index_file.header["build_id"]
+
+        shape = tuple(index_file.header["vsm_shape"])
+        arrays = [index_file.array(f"vsm_{part}") for part in ("data", "indices", "indptr")]
+        model.tf_idf_scores = csr_matrix(tuple(arrays), shape=shape, copy=False)
+        arrays = [index_file.array(f"vsm_csc_{part}") for part in ("data", "indices", "indptr")]
+        model._columns = csc_matrix(tuple(arrays), shape=shape, copy=False)
+        model._column_max = index_file.array("vsm_column_max")
+
+        weighting = index_file.header["vsm_weighting"]
+        model.tf, model.idf = weighting["tf"], weighting["idf"]
+        model.custom_vectorizer = idf_fns.fitted_vectorizer(index_file.strings("vocab").lookup(),
+                                                            index_file.array("vsm_idf"), weighting["tf"])
+        return model
+
+    def refresh(self, index: InvertedIndex = None):
         '''
-        Returns dictionary with: Doc_name -> Content_String
+        Refits the TF-IDF matrix after the corpus changed, from the postings
+        of the shared index, or of one built over the corpus's cached tokens
         '''
-        name_content = {}
-
-        file_names = glob.glob(self.folder_path)
-
-        for file in file_names:
-            name = os.path.basename(file)
-            print(f"[BOOL] Now Loading: \'{name}\', into memory")
-
-            with open(file, 'r') as f:
-                if len_lim:
-                    data = f.read(len_lim)
-                else:
-                    data = f.read()
-            name_content[name] = data
+        if index is None:
+            index = InvertedIndex({doc: Counter(tokens) for doc, tokens in self.corpus.tokens.items()},
+                                  analyzer=self.corpus.analyzer)
+        self.analyzer = index.analyzer
+        self.doc_names = index.doc_names
+        self.index_version = uuid.uuid4().hex
+        self.tf_idf_scores, self.custom_vectorizer = idf_fns.index_tfidf(index, self.tf, self.idf)
+        self._columns = None
+
+    def _column_index(self):
+        '''
+        The TF-IDF matrix in CSC format plus each column's largest weight, built on first use
+        '''
+        if getattr(self, "_columns", None) is None:
+            columns = self.tf_idf_scores.tocsc()
+            columns.sort_indices()
+            nonempty = np.diff(columns.indptr) > 0
+            self._column_max = np.zeros(columns.shape[1])
+            self._column_max[nonempty] = np.maximum.reduceat(columns.data, columns.indptr[:-1][nonempty])
+            self._columns = columns
+        return self._columns
+
+    def return_top_n(self, query: str, n: int, pruning: str = None):
+        tfidf_query = idf_fns.sklearn_tfidif_query(query, self.custom_vectorizer, self.analyzer)
+        doc_names = self.doc_names
+
+        if pruning == "maxscore":
+            results, self.last_postings_visited = self._max_score(tfidf_query, n)
+        else:
+            results = idf_fns.sparse_cos_top_n(tfidf_query, self._column_index(), n)
+
+        return [(doc_names[doc], score) for doc, score in results]
+
+    def return_top_n_batch(self, queries: list[str], n: int):
+        '''
+        `return_top_n` for many queries, scored as one sparse matrix product
+        '''
+        q_mat = idf_fns.sklearn_tfidf_queries(queries, self.custom_vectorizer, self.analyzer)
+        doc_names = self.doc_names
 
-        return name_content
+        return [[(doc_names[doc], score) for doc, score in results]
+                for results in idf_fns.sparse_cos_top_n_batch(q_mat, self.tf_idf_scores, n)]
 
-    def _doc_processor(self, docs: dict[str, str]):
+    def _max_score(self, tfidf_query, n: int):
         '''
-        Preprocesses documents into the specified standard
+        Cosine top-n with MaxScore. Rows of the TF-IDF matrix are L2
+        normalised, so a term's upper bound is its largest column weight
+        times its query weight.
         '''
-        preprocessed_docs = {}
+        columns = self._column_index()
+        postings = []
+        for term, weight in zip(tfidf_query.indices, tfidf_query.data):
+            start, end = columns.indptr[term], columns.indptr[term + 1]
+            postings.append((columns.indices[start:end].tolist(),
+                             (columns.data[start:end] * weight).tolist(),
+                             self._column_max[term] * weight))
 
-        for doc_title, doc_content in docs.items():
-            preprocessed_docs[doc_title] = " ".join(preprocess(doc_content))
+        return max_score(postings, n)
 
-        return preprocessed_docs
+class BooleanIR:
+    def __init__(self, folder_path: str = None, corpus: Corpus = None, index: InvertedIndex = None):
+        self.corpus = corpus if corpus is not None else Corpus(folder_path)
+        self.folder_path = self.corpus.folder_path
+        self.documents = self.corpus.documents
+        self.inverted_index = index if index is not None else self._create_inverted_index()
+
+    @classmethod
+    def from_index_file(cls, path: str) -> "BooleanIR":
+        """Opens the inverted index of an index file written by `write_index_file`."""
+        index_file = open_index_file(path)
+
+        model = cls.__new__(cls)
+        model.corpus = model.documents = None
+        model.folder_path = index_file.folder_path
+        model.refresh(index_file.inverted_index())
+        return model
 
     def _create_inverted_index(self):
-        """Creates an inverted index from the documents."""
-        inverted_index = defaultdict(set)
-        for doc_name, content in self.processed_docs.items():
-            for token in content.split():
-                inverted_index[token].add(doc_name)
-        return inverted_index
+        """Creates a positional inverted index from the documents."""
+        return InvertedIndex(tokens=self.corpus.tokens, analyzer=self.corpus.analyzer)
+
+    def refresh(self, index: InvertedIndex = None):
+        """Switches to an updated index, dropping plans compiled against the old one."""
+        self.inverted_index = index if index is not None else self._create_inverted_index()
+        self._query_compiler = None
+        self._posting_algebra = None
+
+    @property
+    def index_version(self) -> tuple:
+        """Identifies the index contents; changes on every rebuild or update."""
+        return self.inverted_index.build_id, self.inverted_index.version
+
+    @property
+    def analyzer(self) -> str:
+        """The analyzer the index was built with, applied to every query."""
+        return self.inverted_index.analyzer
 
     def query(self, boolean_query):
         """Processes a Boolean query and returns matching document names."""
-        tokens = re.findall(r'NOT|AND|OR|\(|\)|\w+', boolean_query.upper())
-        postfix = self._to_postfix(tokens)
-        print(f"Postfix query: {postfix}")  # Debugging output
-        return self._evaluate_postfix(postfix)
-
-    def _to_postfix(self, tokens):
-        """Converts infix Boolean query to postfix notation using the Shunting-yard algorithm."""
-        precedence = {'NOT': 3, 'AND': 2, 'OR': 1, '(': 0, ')': 0}
-        output = []
-        stack = []
-
-        for token in tokens:
-            if token.isalnum():
-                output.append(token)
-            elif token == '(':
-                stack.append(token)
-            elif token == ')':
-                while stack and stack[-1] != '(':
-                    output.append(stack.pop())
-                stack.pop()
-            else:  # Operator
-                while stack and precedence[token] <= precedence[stack[-1]]:
-                    output.append(stack.pop())
-                stack.append(token)
-
-        while stack:
-            output.append(stack.pop())
-
-        return output
-
-    def _evaluate_postfix(self, postfix):
-        """Evaluates a postfix Boolean query and returns matching document names."""
-        stack = []
-
-        for token in postfix:
-            if token.isalnum():
-                matching_docs = self.inverted_index.get(token.lower())
-                stack.append(matching_docs)
-            elif token == 'NOT':
-                operand = stack.pop()
-                all_docs = set(self.documents.keys())
-                result = all_docs - operand
-                stack.append(result)
-            else:  # AND or OR
-                right = stack.pop()
-                left = stack.pop()
-                if token == 'AND':
-                    result = left & right
-                    stack.append(result)
-                elif token == 'OR':
-                    result = left | right
-                    stack.append(result)
-
-        final_result = stack.pop() if stack else set()
-        return final_result
+        plan = self._compiler().compile(boolean_query)
+        result = evaluate(plan, self._algebra())
 
-class BM25:
-    def __init__(self, folder_path: str, len_lim: int = 100_000):
-        self.folder_path = folder_path
-        self.len_lim = len_lim
+        doc_names = self.inverted_index.doc_names
+        return {doc_names[doc_id] for doc_id in self._algebra().materialize(result).tolist()}
 
-        # Load and preprocess documents
-        self.documents = self._load_documents(len_lim)
-        self.preprocessed_docs = self._doc_processor(self.documents)
+    def explain(self, boolean_query) -> str:
+        """The normalized, cost-ordered plan a query compiles to."""
+        return to_string(self._compiler().compile(boolean_query))
 
-        # Compute document statistics
-        self.doc_lengths = {doc: len(content.split()) for doc, content in self.preprocessed_docs.items()}
-        self.avg_doc_length = sum(self.doc_lengths.values()) / len(self.doc_lengths)
-        self.inverted_index = self._build_inverted_index(self.preprocessed_docs)
-        self.doc_count = len(self.preprocessed_docs)
+    def _compiler(self) -> QueryCompiler:
+        """Query compiler and plan cache for the index, created on first use."""
+        if getattr(self, "_query_compiler", None) is None:
+            self._query_compiler = QueryCompiler(self.inverted_index,
+                                                 analyzer=partial(preprocess, analyzer=self.analyzer))
+        return self._query_compiler
 
-    def _load_documents(self, len_lim: int = 100_000) -> dict[str, str]:
+    def _algebra(self) -> PostingAlgebra:
+        """Posting-list operators over the index, created on first use."""
+        if getattr(self, "_posting_algebra", None) is None:
+            self._posting_algebra = PostingAlgebra(self.inverted_index)
+        return self._posting_algebra
+
+class BM25:
+    def __init__(self, folder_path: str = None, len_lim: int = None, corpus: Corpus = None,
+                 index: InvertedIndex = None, impact_ordered: bool = False):
+        self.corpus = corpus if corpus is not None else Corpus(folder_path, len_lim)
+        self.folder_path = self.corpus.folder_path
+        self.documents = self.corpus.documents
+
+        # Document statistics come from the index built over the shared corpus
+        self.impact_index = None
+        self.refresh(index)
+
+        # Optional precomputed BM25 impacts for the default k1/b
+        if impact_ordered:
+            self.build_impact_index()
+
+    @classmethod
+    def from_index_file(cls, path: str, impact_ordered: bool = False) -> "BM25":
         """
-        Load `.txt` files and return a dictionary mapping file names to their content.
+        Opens the inverted index of an index file written by `write_index_file`.
         """
-        name_content = {}
-        file_names = glob.glob(self.folder_path)
+        index_file = open_index_file(path)
 
-        for file in file_names:
-            name = os.path.basename(file)
-            print(f"[BM25] Loading: '{name}' into memory")
+        model = cls.__new__(cls)
+        model.corpus = model.documents = None
+        model.folder_path = index_file.folder_path
+        model.impact_index = None
+        model.refresh(index_file.inverted_index())
 
-            with open(file, 'r') as f:
-                if len_lim:
-                    data = f.read(len_lim)
-                else:
-                    data = f.read()
-            name_content[name] = data
+        if impact_ordered:
+            model.build_impact_index()
+        return model
 
-        return name_content
+    def refresh(self, index: InvertedIndex = None):
+        """
+        Switches to an updated index, recomputing the collection statistics
+        and dropping every cache derived from the old one.
+        """
+        self.inverted_index = index if index is not None else self._build_inverted_index()
+        self.doc_lengths = self.inverted_index.doc_lengths
+        self.avg_doc_length = self.inverted_index.avg_doc_length
+        self.doc_count = self.inverted_index.num_docs
+        self.doc_freqs = None
+        self._norms = {}
+        self._bounds = {}
+        self._matrices = {}
+
+        impact_index = self.impact_index
+        if impact_index is not None:
+            self.build_impact_index(impact_index.k1, impact_index.b, impact_index.bits)
+
+    def _build_inverted_index(self) -> InvertedIndex:
+        """
+        Build an inverted index mapping terms to document frequencies and positions.
+        """
+        return InvertedIndex(tokens=self.corpus.tokens, analyzer=self.corpus.analyzer)
 
-    def _doc_processor(self, docs: Dict[str, str]) -> dict[str, str]:
+    @property
+    def index_version(self) -> tuple:
         """
-        Preprocess documents to lowercase and tokenize them by splitting on whitespace.
+        Identifies the index contents; changes on every rebuild or update.
         """
-        def preprocess(text: str) -> list[str]:
-            return text.lower().split()
+        return self.inverted_index.build_id, self.inverted_index.version
 
-        preprocessed_docs = {}
+    @property
+    def analyzer(self) -> str:
+        """
+        The analyzer the index was built with, applied to every query.
+        """
+        return self.inverted_index.analyzer
 
-        for doc_title, doc_content in docs.items():
-            preprocessed_docs[doc_title] = " ".join(preprocess(doc_content))
+    def set_collection_stats(self, doc_count: int, avg_doc_length: float, doc_freqs: dict[str, int]):
+        """
+        Scores with collection-wide statistics instead of this index's own,
+        for when the index is one shard of a larger collection. `doc_freqs`
+        must cover every query term.
+        """
+        self.doc_count = doc_count
+        self.avg_doc_length = avg_doc_length
+        self.doc_freqs = doc_freqs
+        self._norms = {}
+        self._bounds = {}
+        self._matrices = {}
+
+    def _length_norm(self, k1: float, b: float) -> np.ndarray:
+        """
+        Per-document `k1 * (1 - b + b * dl / avgdl)`, cached per (k1, b).
+        """
+        if (k1, b) not in self._norms:
+            self._norms[(k1, b)] = k1 * (1 - b + b * self.doc_lengths / self.avg_doc_length)
+        return self._norms[(k1, b)]
 
-        return preprocessed_docs
+    def build_impact_index(self, k1: float = 1.5, b: float = 0.75, bits: int = 8) -> ImpactIndex:
+        """
+        Precompute quantized BM25 impacts for a fixed k1/b, used by top-n
+        queries with those parameters and `pruning="impact"`.
+        """
+        self.impact_index = ImpactIndex(self.inverted_index, k1, b, bits)
+        return self.impact_index
 
-    def _build_inverted_index(self, docs: dict[str, str]) -> dict[str, dict[str, int]]:
+    def term_upper_bounds(self, k1: float = 1.5, b: float = 0.75) -> np.ndarray:
         """
-        Build an inverted index mapping terms to document frequencies.
+        Largest BM25 contribution of every term for k1/b, cached per (k1, b).
         """
-        inverted_index = {}
-        for doc, content in docs.items():
-            term_freq = Counter(content.split())
-            for term, freq in term_freq.items():
-                if term not in inverted_index:
-                    inverted_index[term] = {}
-                inverted_index[term][doc] = freq
-        return inverted_index
+        if (k1, b) not in self._bounds:
+            weights = self.inverted_index.bm25_weights(k1, b)
+            self._bounds[(k1, b)] = np.maximum.reduceat(weights, self.inverted_index.offsets[:-1]) \
+                if len(weights) else np.zeros(0)
+        return self._bounds[(k1, b)]
 
-    def compute_bm25(self, query: str, k1: float = 1.5, b: float = 0.75):
+    def _term_weights(self, term: str, k1: float, b: float) -> tuple[np.ndarray, np.ndarray]:
         """
-        Compute BM25 scores for the query across all documents.
+        (doc_ids, BM25 contributions) of one term's postings.
         """
-        query_terms = query.lower().split()
-        scores = {doc: 0 for doc in self.preprocessed_docs}
+        doc_freq = self.doc_freqs[term] if self.doc_freqs is not None else self.inverted_index.doc_freq(term)
+        idf = math.log((self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+        doc_ids, freqs = self.inverted_index.postings(term)
+        norm = self._length_norm(k1, b)
 
-        for term in query_terms:
-            if term in self.inverted_index:
-                doc_freq = len(self.inverted_index[term])
-                idf = math.log((self.doc_count - doc_freq + 0.5) / (doc_freq + 0.5) + 1)
+        return doc_ids, idf * (freqs * (k1 + 1) / (freqs + norm[doc_ids]))
+
+    def compute_bm25(self, query: str, k1: float = 1.5, b: float = 0.75, top_n: int = None,
+                     pruning: str = None, proximity_weight: float = 0.0, proximity_window: int = 5):
+        """
+        Compute BM25 scores for the query across all documents.
+        Returns the `top_n` best (doc, score) pairs, or every matching document when it is None.
+        `pruning="maxscore"` skips documents that cannot reach the top `top_n`;
+        `pruning="impact"` sums quantized impacts instead, so scores are approximate.
+        A positive `proximity_weight` boosts documents where consecutive query
+        terms occur within `proximity_window` positions (needs positions).
+        """
+        query_terms = preprocess(query, analyzer=self.analyzer)
+        doc_names = self.inverted_index.doc_names
+
+        if proximity_weight:
+            scores = self._scores(query_terms, k1, b)
+            self._proximity_boost(scores, query_terms, proximity_weight, proximity_window, top_n)
+            return [(doc_names[doc], float(scores[doc])) for doc in top_matches(scores, top_n)]
+
+        # Impacts and upper bounds are precomputed from this index's own statistics
+        local_stats = self.doc_freqs is None
+
+        if pruning == "impact" and top_n and local_stats:
+            impact_index = self.impact_index
+            if impact_index is None or (impact_index.k1, impact_index.b) != (k1, b):
+                impact_index = self.build_impact_index(k1, b)
+            results = impact_index.search(query_terms, top_n)
+            self.last_postings_visited = impact_index.last_postings_visited
+            return results
+
+        if pruning == "maxscore" and top_n and local_stats:
+            results, self.last_postings_visited = self._max_score(query_terms, k1, b, top_n)
+            return [(doc_names[doc], score) for doc, score in results]
+
+        scores = self._scores(query_terms, k1, b)
+        return [(doc_names[doc], float(scores[doc])) for doc in top_matches(scores, top_n)]
+
+    def compute_bm25_batch(self, queries: list[str], k1: float = 1.5, b: float = 0.75,
+                           top_n: int = None) -> list[list[tuple[str, float]]]:
+        """
+        `compute_bm25` for many queries: preprocessed in one batch and scored
+        as a single sparse product of the query-term counts with the
+        documents' BM25 weight matrix.
+        """
+        token_lists = preprocess_batch(queries, analyzer=self.analyzer)
+        doc_names = self.inverted_index.doc_names
+
+        if self.doc_freqs is not None:
+            scores = [self._scores(query_terms, k1, b) for query_terms in token_lists]
+            return [[(doc_names[doc], float(row[doc])) for doc in top_matches(row, top_n)] for row in scores]
+
+        rows, columns = [], []
+        for row, query_terms in enumerate(token_lists):
+            for term in query_terms:
+                term_id = self.inverted_index.terms.get(term)
+                if term_id is not None:
+                    rows.append(row)
+                    columns.append(term_id)
+
+        # Duplicate (row, column) entries add up, giving the query-term counts
+        counts = csr_matrix((np.ones(len(rows)), (rows, columns)),
+                            shape=(len(queries), len(self.inverted_index)))
+        scores = (counts @ self._weight_matrix(k1, b).T).tocsr()
+
+        results = []
+        for row in range(len(queries)):
+            dense = np.zeros(self.inverted_index.num_docs)
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            dense[scores.indices[start:end]] = scores.data[start:end]
+            results.append([(doc_names[doc], float(dense[doc])) for doc in top_matches(dense, top_n)])
+
+        return results
+
+    def _weight_matrix(self, k1: float, b: float) -> csc_matrix:
+        """
+        Every posting's BM25 weight as a documents x terms CSC matrix, cached
+        per (k1, b). The postings are already term-major, so they are the columns.
+        """
+        if (k1, b) not in self._matrices:
+            docs, _ = self.inverted_index.flat_postings()
+            self._matrices[(k1, b)] = csc_matrix(
+                (self.inverted_index.bm25_weights(k1, b), docs, self.inverted_index.offsets),
+                shape=(self.inverted_index.num_docs, len(self.inverted_index)))
+        return self._matrices[(k1, b)]
 
-                for doc, freq in self.inverted_index[term].items():
-                    term_freq = freq
-                    doc_length = self.doc_lengths[doc]
+    def _scores(self, query_terms: list[str], k1: float, b: float) -> np.ndarray:
+        scores = np.zeros(self.inverted_index.num_docs)
 
-                    numerator = term_freq * (k1 + 1)
-                    denominator = term_freq + k1 * (1 - b + b * doc_length / self.avg_doc_length)
+        for term in query_terms:
+            if term not in self.inverted_index:
+                continue
 
-                    scores[doc] += idf * (numerator / denominator)
+            doc_ids, weights = self._term_weights(term, k1, b)
+            scores[doc_ids] += weights
 
-        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return scores
 
+    def _proximity_boost(self, scores: np.ndarray, query_terms: list[str], weight: float,
+                         window: int, top_n: int = None, depth: int = 100):
+        """
+        Re-scores the best `max(depth, 10 * top_n)` documents in place: each
+        pair of consecutive distinct query terms found `d <= window` positions
+        apart adds `weight * (window - d + 1) / window`.
+        """
+        if not self.inverted_index.positional:
+            raise ValueError("Proximity scoring needs a positional index")
+
+        pairs = [(left, right) for left, right in zip(query_terms, query_terms[1:])
+                 if left != right and left in self.inverted_index and right in self.inverted_index]
+        if not pairs:
+            return
+
+        for doc in top_k(scores, max(depth, 10 * (top_n or 0))).tolist():
+            if scores[doc] <= 0:
+                break
+            for left, right in pairs:
+                distance = min_distance(self.inverted_index.positions(left, doc),
+                                        self.inverted_index.positions(right, doc))
+                if distance <= window:
+                    scores[doc] += weight * (window - distance + 1) / window
+
+    def _max_score(self, query_terms: list[str], k1: float, b: float, top_n: int):
+        bounds = self.term_upper_bounds(k1, b)
+        postings = []
+
+        for term, count in Counter(query_terms).items():
+            if term not in self.inverted_index:
+                continue
+
+            doc_ids, weights = self._term_weights(term, k1, b)
+            postings.append((doc_ids.tolist(), (weights * count).tolist(),
+                             bounds[self.inverted_index.terms[term]] * count))
+
+        return max_score(postings, top_n)
+
+
+def build_models(folder_path: str, workers: int = 1, analyzer: str = None) -> dict:
+    '''
+    Loads and preprocesses the corpus once and builds all three models on it,
+    sharding the preprocessing and indexing across `workers` processes
+    '''
+    if workers > 1:
+        corpus, index = build_parallel(folder_path, workers, analyzer=analyzer)
+    else:
+        corpus = Corpus(folder_path, analyzer=analyzer)
+        index = InvertedIndex(tokens=corpus.tokens, analyzer=corpus.analyzer)
+
+    return {
+        "corpus": corpus,
+        "index": index,
+        "vsm": VectorSpaceModel(corpus=corpus, index=index),
+        "bool": BooleanIR(corpus=corpus, index=index),
+        "bm25": BM25(corpus=corpus, index=index)
+    }
+
+def load_models(path: str = None, index_file: str = None, workers: int = BUILD_WORKERS) -> dict:
+    '''
+    The three models, opened from an index file or loaded through the index store
+    '''
+    if index_file:
+        return {"bm25": BM25.from_index_file(index_file),
+                "vsm": VectorSpaceModel.from_index_file(index_file),
+                "bool": BooleanIR.from_index_file(index_file)}
+
+    return IndexStore(path).load_or_build("models", lambda: build_models(path, workers), sync_models)
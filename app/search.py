@@ -0,0 +1,101 @@
+import sys
+import time
+import argparse
+import itertools
+from retrieval_models import load_models
+
+MODELS = ("bm25", "vsm", "bool")
+
+# Queries preprocessed and scored together; bounds memory for any size of query log
+BATCH_SIZE = 512
+
+def read_queries(path: str):
+    '''
+    Streams (query_id, query) pairs from a query log. Lines are either
+    `query_id<TAB>query` or a bare query, numbered by line; blank lines
+    and lines starting with `#` are skipped.
+    '''
+    with open(path, 'r', encoding="utf-8", errors="replace") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+
+            query_id, tab, query = line.partition("\t")
+            yield (query_id.strip(), query.strip()) if tab else (str(line_number), line)
+
+def batches(iterable, size: int):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+def search_batch(model_name: str, model, queries: list[str], k: int) -> list[list[tuple[str, float]]]:
+    '''
+    Top-k (post_name, score) lists for a batch of queries with one vectorized call.
+    Posts scoring 0 match no query term and are left out, so a list can be
+    shorter than k. Boolean matches are unranked, so they come back in name
+    order with score 1.
+    '''
+    if model_name in ("bm25", "vsm"):
+        if model_name == "bm25":
+            results = model.compute_bm25_batch(queries, top_n=k)
+        else:
+            results = model.return_top_n_batch(queries, k)
+        return [[(name, score) for name, score in result if score > 0] for result in results]
+
+    results = []
+    for query in queries:
+        try:
+            results.append([(name, 1.0) for name in sorted(model.query(query))[:k]])
+        except ValueError as error:
+            print(f"[SEARCH] Skipping boolean query {query!r}: {error}", file=sys.stderr)
+            results.append([])
+    return results
+
+def trec_lines(query_id: str, results: list[tuple[str, float]], run_tag: str):
+    '''
+    TREC run lines: query_id Q0 doc_id rank score run_tag
+    '''
+    for rank, (doc, score) in enumerate(results, 1):
+        yield f"{query_id} Q0 {doc} {rank} {score:.6f} {run_tag}\n"
+
+def run(model_name: str, model, queries_path: str, out, k: int, run_tag: str,
+        batch_size: int = BATCH_SIZE) -> int:
+    '''
+    Searches every query of the log, writing results batch by batch. Returns the query count.
+    '''
+    count = 0
+    started = time.perf_counter()
+
+    for batch in batches(read_queries(queries_path), batch_size):
+        results = search_batch(model_name, model, [query for _, query in batch], k)
+        for (query_id, _), result in zip(batch, results):
+            out.writelines(trec_lines(query_id, result, run_tag))
+        out.flush()
+
+        count += len(batch)
+        elapsed = time.perf_counter() - started
+        print(f"[SEARCH] {count} queries in {elapsed:.1f}s ({count / elapsed:.0f} queries/s)", file=sys.stderr)
+
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a query log against the corpus and write a TREC run")
+    parser.add_argument("--model", choices=MODELS, default="bm25")
+    parser.add_argument("--queries", required=True, help="Query log: one query, or `id<TAB>query`, per line")
+    parser.add_argument("--k", type=int, default=100, help="Results per query")
+    parser.add_argument("--out", default="-", help="Run file to write, or - for stdout")
+    parser.add_argument("--path", default="data/*.txt", help="Glob of newsgroup dump files")
+    parser.add_argument("--index", help="Search an index file written by index_file.py instead")
+    parser.add_argument("--run-tag", default=None, help="Run name in the last column (default: the model)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    model = load_models(args.path, args.index)[args.model]
+
+    out = sys.stdout if args.out == "-" else open(args.out, 'w', encoding="utf-8")
+    try:
+        run(args.model, model, args.queries, out, args.k, args.run_tag or args.model, args.batch_size)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,234 @@
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from retrieval_models import load_models
+from result_cache import ResultCache, result_cache, query_key, MISSING
+
+MODELS = ("bm25", "vsm", "bool")
+MAX_K = 1000
+
+# A batch is sent for scoring once it holds MAX_BATCH queries, or
+# BATCH_WINDOW seconds after its first query arrived
+MAX_BATCH = 32
+BATCH_WINDOW = 0.005
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               500: "Internal Server Error"}
+
+class MicroBatcher:
+    '''
+    Gathers concurrent requests for one model and scores them with a
+    single call to `run_batch(queries, k)` on the executor, so the event
+    loop never runs preprocessing or scoring itself
+    '''
+    def __init__(self, run_batch, executor, max_batch: int = MAX_BATCH, window: float = BATCH_WINDOW):
+        self.run_batch = run_batch
+        self.executor = executor
+        self.max_batch = max_batch
+        self.window = window
+        self.pending = []
+        self.batches = 0
+        self.queries = 0
+        self._timer = None
+
+    async def submit(self, query: str, k: int):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((query, k, future))
+
+        if len(self.pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            self.batches += 1
+            self.queries += len(batch)
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        queries = [query for query, _, _ in batch]
+        k = max(k for _, k, _ in batch)
+
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.run_batch, queries, k)
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        # A batch may fail single queries by returning their exception in place of results
+        for (_, k, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result[:k])
+
+class QueryServer:
+    '''
+    Headless HTTP/JSON front end over warm models:
+
+        GET /search?model=bm25|vsm|bool&q=...&k=10
+        GET /stats
+    '''
+    def __init__(self, models: dict, workers: int = 4, max_batch: int = MAX_BATCH,
+                 window: float = BATCH_WINDOW, cache: ResultCache = result_cache):
+        self.models = models
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="search")
+        self.batchers = {
+            "bm25": MicroBatcher(self._bm25_batch, self.executor, max_batch, window),
+            "vsm": MicroBatcher(self._vsm_batch, self.executor, max_batch, window),
+            "bool": MicroBatcher(self._bool_batch, self.executor, max_batch, window),
+        }
+        self.requests = 0
+
+    def _bm25_batch(self, queries: list[str], k: int):
+        return self.models["bm25"].compute_bm25_batch(queries, top_n=k)
+
+    def _vsm_batch(self, queries: list[str], k: int):
+        return self.models["vsm"].return_top_n_batch(queries, k)
+
+    def _bool_batch(self, queries: list[str], k: int):
+        results = []
+        for query in queries:
+            try:
+                results.append([(name, None) for name in sorted(self.models["bool"].query(query))])
+            except ValueError as error:
+                results.append(error)
+        return results
+
+    async def search(self, model: str, query: str, k: int) -> dict:
+        if model not in MODELS:
+            raise ValueError(f"Unknown model '{model}', expected one of {', '.join(MODELS)}")
+        if not query.strip():
+            raise ValueError("Empty query")
+        if not 0 < k <= MAX_K:
+            raise ValueError(f"k must be between 1 and {MAX_K}")
+
+        started = time.perf_counter()
+
+        # Building the key preprocesses the query, so it runs off the event loop too
+        key = await asyncio.get_running_loop().run_in_executor(
+            self.executor, query_key, model, self.models[model], query, k)
+        results = self.cache.get(key, MISSING)
+        cached = results is not MISSING
+
+        if not cached:
+            scoring_started = time.perf_counter()
+            results = await self.batchers[model].submit(query, k)
+            self.cache.put(key, results, time.perf_counter() - scoring_started)
+
+        return {"model": model, "query": query, "k": k, "cached": cached,
+                "results": [{"doc": doc, "score": score} if score is not None else {"doc": doc}
+                            for doc, score in results],
+                "took_ms": round((time.perf_counter() - started) * 1000, 3)}
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "cache": self.cache.stats(),
+                "batches": {model: {"batches": batcher.batches, "queries": batcher.queries,
+                                    "mean_size": batcher.queries / batcher.batches if batcher.batches else 0.0}
+                            for model, batcher in self.batchers.items()}}
+
+    async def route(self, method: str, target: str) -> tuple[int, dict]:
+        if method != "GET":
+            return 405, {"error": f"{method} is not supported"}
+
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/stats":
+            return 200, self.stats()
+        if url.path != "/search":
+            return 404, {"error": f"No such endpoint '{url.path}'"}
+
+        try:
+            k = int(params.get("k", 10))
+            return 200, await self.search(params.get("model", "bm25"), params.get("q", ""), k)
+        except ValueError as error:
+            return 400, {"error": str(error)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        '''
+        Serves HTTP/1.1 requests on one connection until the client closes it
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                self.requests += 1
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    status, body = await self.route(method, target)
+                except ValueError:
+                    status, body, version = 400, {"error": "Malformed request line"}, "HTTP/1.0"
+                except Exception as error:
+                    status, body, version = 500, {"error": str(error)}, "HTTP/1.0"
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                payload = json.dumps(body).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                             + payload)
+                await writer.drain()
+
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"[SERVER] Listening on http://{host}:{port}")
+
+        async with server:
+            await server.serve_forever()
+
+def warm_up(models: dict):
+    '''
+    Runs one query through every model so lazy indexes and caches are built before serving
+    '''
+    models["bm25"].compute_bm25_batch(["warm up"], top_n=1)
+    models["vsm"].return_top_n("warm up", 1)
+    models["bool"].query("warm")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless Fetcher query server")
+    parser.add_argument("--path", default="data/*.txt", help="Glob of newsgroup dump files")
+    parser.add_argument("--index", help="Serve from an index file written by index_file.py instead")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=4, help="Scoring threads")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--window-ms", type=float, default=BATCH_WINDOW * 1000)
+    args = parser.parse_args()
+
+    models = load_models(args.path, args.index)
+    warm_up(models)
+
+    server = QueryServer(models, args.workers, args.max_batch, args.window_ms / 1000)
+    asyncio.run(server.serve(args.host, args.port))
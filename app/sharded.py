@@ -0,0 +1,120 @@
+import os
+import glob
+from concurrent.futures import ProcessPoolExecutor
+from corpus import Corpus
+from ranking import top_matches, merge_top_k
+from preprocessing import preprocess
+from inverted_index import InvertedIndex
+from index_file import open_index_file, write_index_file
+from retrieval_models import BM25, BooleanIR
+
+# Shard models opened by this (worker) process, keyed on index file path.
+# Every worker maps every shard, so any worker can serve any shard and the
+# pages are shared through the OS page cache.
+_shards = {}
+
+def build_shards(corpus: Corpus, out_dir: str) -> list[str]:
+    '''
+    Splits the corpus by newsgroup and writes one index file per group,
+    numbered in corpus order. Returns the shard paths.
+    '''
+    groups = {}
+    for name, tokens in corpus.tokens.items():
+        groups.setdefault(name.split("/", 1)[0], {})[name] = tokens
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for i, (newsgroup, tokens) in enumerate(groups.items()):
+        path = os.path.join(out_dir, f"{i:03d}-{newsgroup}.idx")
+        write_index_file(path, {"corpus": corpus, "index": InvertedIndex(tokens=tokens, analyzer=corpus.analyzer)})
+        paths.append(path)
+        print(f"[SHARD] Wrote \'{newsgroup}\' ({len(tokens)} posts) to {path}")
+
+    return paths
+
+def _shard(path: str, model: type):
+    key = (path, model)
+    if key not in _shards:
+        _shards[key] = model.from_index_file(path)
+    return _shards[key]
+
+def search_shard(path: str, query_terms: list[str], k: int, k1: float, b: float,
+                 stats: tuple[int, float, dict[str, int]]) -> list[tuple[str, float]]:
+    '''
+    Worker side: BM25 top-k of one shard under the collection-wide `stats`
+    '''
+    bm25 = _shard(path, BM25)
+    bm25.set_collection_stats(*stats)
+
+    names = bm25.inverted_index.doc_names
+    scores = bm25._scores(query_terms, k1, b)
+    return [(names[doc], float(scores[doc])) for doc in top_matches(scores, k)]
+
+def query_shard(path: str, boolean_query: str) -> set[str]:
+    '''
+    Worker side: names of one shard's posts matching a boolean query
+    '''
+    return _shard(path, BooleanIR).query(boolean_query)
+
+class ShardedSearcher:
+    '''
+    Scatter-gather search over per-newsgroup index files.
+
+    Queries are preprocessed once, fanned out to every shard over a
+    process pool, and the per-shard top-k lists merged with a heap.
+    BM25 runs with collection-wide document counts, average length and
+    document frequencies, so scores equal those of a single index over
+    the whole corpus. `workers=0` searches the shards in-process.
+    '''
+    def __init__(self, shard_paths, workers: int = None):
+        if isinstance(shard_paths, str):
+            shard_paths = sorted(glob.glob(os.path.join(shard_paths, "*.idx")))
+        if not shard_paths:
+            raise ValueError("No index shards to search")
+
+        self.paths = list(shard_paths)
+        self.indexes = [open_index_file(path).inverted_index() for path in self.paths]
+        self.doc_count = sum(index.num_docs for index in self.indexes)
+        total_length = sum(int(index.doc_lengths.sum()) for index in self.indexes)
+        self.avg_doc_length = total_length / self.doc_count if self.doc_count else 0.0
+
+        analyzers = {index.analyzer for index in self.indexes}
+        if len(analyzers) > 1:
+            raise ValueError(f"Shards were built with different analyzers: {sorted(map(str, analyzers))}")
+        self.analyzer = analyzers.pop()
+
+        self.pool = ProcessPoolExecutor(workers or min(len(self.paths), os.cpu_count() or 1)) \
+            if workers != 0 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def _scatter(self, function, *args) -> list:
+        if self.pool is None:
+            return [function(path, *args) for path in self.paths]
+        return list(self.pool.map(function, self.paths, *([arg] * len(self.paths) for arg in args)))
+
+    def doc_freqs(self, terms) -> dict[str, int]:
+        return {term: sum(index.doc_freq(term) for index in self.indexes) for term in set(terms)}
+
+    def search(self, query: str, k: int = 10, k1: float = 1.5, b: float = 0.75) -> list[tuple[str, float]]:
+        '''
+        BM25 top-k over every shard, as (post_name, score) pairs best first
+        '''
+        query_terms = preprocess(query, analyzer=self.analyzer)
+        stats = (self.doc_count, self.avg_doc_length, self.doc_freqs(query_terms))
+
+        return merge_top_k(self._scatter(search_shard, query_terms, k, k1, b, stats), k)
+
+    def query(self, boolean_query: str) -> set[str]:
+        '''
+        Names of the posts in any shard matching a boolean query
+        '''
+        return set().union(*self._scatter(query_shard, boolean_query))
@@ -1,135 +1,192 @@
-import os
-import glob
-import nltk
-import string
 import numpy as np
-from preprocessing import preprocess
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-
-def doc_to_dict(path: str, len_lim: int = 100_000):
+from collections import Counter
+from corpus import load_posts
+from inverted_index import InvertedIndex
+from scipy.sparse import csr_matrix, csc_matrix
+from ranking import top_matches
+from preprocessing import preprocess, preprocess_batch
+
+def doc_to_dict(path: str, len_lim: int = None):
     '''
-    Returns dictionary with: Doc_name -> Content_String
+    Returns dictionary with: Post_name -> Content_String
     '''
-    name_content = {}
-
-    file_names = glob.glob(path)
-
-    for file in file_names:
-        name = os.path.basename(file)  # Extracts the file name with dots intact
-        print(f"[VSM] Now Loading: \'{name}\', into memory")
-
-        with open(file, 'r') as f:
-            if len_lim:
-                data = f.read(len_lim)
-            else:
-                data = f.read()
-        name_content[name] = data
-
-    return name_content
+    return load_posts(path, len_lim, tag="VSM")
 
 def doc_processor(docs: dict[str, str]):
     '''
     Preprocesses documents into the specified standard
     '''
-    preprocessed_docs = {}
+    token_lists = preprocess_batch(list(docs.values()))
 
-    for doc_title, doc_content in docs.items():
-        preprocessed_docs[doc_title] = " ".join(preprocess(doc_content))
+    return {doc_title: " ".join(tokens) for doc_title, tokens in zip(docs, token_lists)}
 
-    return preprocessed_docs
+def sklearn_tfidf(docs: dict[str, str], processed_docs: dict[str, str] = None):
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
-def sklearn_tfidf(docs: dict[str, str]):
     tfidic_vectorizer = TfidfVectorizer()
-    processed_docs = doc_processor(docs)
+    if processed_docs is None:
+        processed_docs = doc_processor(docs)
     return tfidic_vectorizer.fit_transform(processed_docs.values()), tfidic_vectorizer
 
-def sklearn_tfidif_query(query: str, cust_vectorizer: TfidfVectorizer):
-    return cust_vectorizer.transform([' '.join(preprocess(query))])
-
-def sklearn_cos_sim(q_vec, tfidf_mat, docs):
-    similarities = cosine_similarity(q_vec, tfidf_mat)
-
-    results = [(key, similarities[0][i]) for i, key in enumerate(docs)]
-    results.sort(key = lambda x: x[1], reverse = True)
-    return results
-
-def build_vocab(docs: dict[str, str]):
+def fitted_vectorizer(vocabulary, idf: np.ndarray, tf: str = "raw", norm: str = "l2") -> "TfidfWeighting":
     '''
-    Vocabulary Builder
+    A `TfidfWeighting` restored from a stored vocabulary and idf weights.
+    `vocabulary` is any mapping of term -> column supporting `[]`, `get` and `len`.
     '''
-    vocab = []
+    return TfidfWeighting(vocabulary, idf, tf, norm)
 
-    for doc in docs.values():
-        for word in doc:
-            if word not in vocab:
-                vocab.append(word)
+def sklearn_tfidif_query(query: str, cust_vectorizer: "TfidfWeighting", analyzer: str = None):
+    return cust_vectorizer.transform([' '.join(preprocess(query, analyzer=analyzer))])
 
-    return vocab
-
-def term_freq(doc_vocab: list[str], docs: dict[str, str]):
+def sklearn_tfidf_queries(queries: list[str], cust_vectorizer: "TfidfWeighting", analyzer: str = None):
     '''
-    Returns the Term Frequency in every document
-    `doc_id`, `word`: `count(word, doc)`
+    Vectorizes many queries at once, preprocessing them in a single batch
     '''
-    tf_docs = {}
+    return cust_vectorizer.transform([' '.join(tokens) for tokens in preprocess_batch(queries, analyzer=analyzer)])
 
-    for doc_id in docs.keys():
-        tf_docs[doc_id] = {}
+def sparse_cos_top_n(q_vec, tfidf_columns, n: int = None):
+    '''
+    Top `n` (doc_index, cosine) pairs for one query.
 
-    for word in doc_vocab:
-        for doc_id, doc in docs.items():
-            tf_docs[doc_id][word] = doc.count(word)
+    TF-IDF rows and the query are already L2 normalised, so the cosine is a
+    plain dot product; only the matrix columns of the query's terms are read.
+    `tfidf_columns` is the TF-IDF matrix in CSC format.
+    '''
+    q_vec = q_vec.tocsr()
+    scores = tfidf_columns[:, q_vec.indices] @ q_vec.data
 
-    return tf_docs
+    return [(doc, float(scores[doc])) for doc in top_matches(scores, n)]
 
-def word_freq(vocab: list[str], docs: dict[str, str]):
+def sparse_cos_top_n_batch(q_mat, tfidf_mat, n: int = None):
     '''
-    Returning the word frequency in a given set of documents
+    `sparse_cos_top_n` for every row of `q_mat`, scored as one sparse matrix product
     '''
-    document_freq = {}
+    similarities = (q_mat @ tfidf_mat.T).tocsr()
+    results = []
 
-    for word in vocab:
-        freq = 0
+    for row in range(similarities.shape[0]):
+        scores = similarities.getrow(row).toarray().ravel()
+        results.append([(doc, float(scores[doc])) for doc in top_matches(scores, n)])
 
-        for doc in docs.values():
-            if word in doc:
-                freq += doc.count(word)
+    return results
 
-        document_freq[word] = freq
+def sklearn_cos_sim(q_vec, tfidf_mat, docs):
+    from sklearn.metrics.pairwise import cosine_similarity
 
-    return document_freq
+    similarities = cosine_similarity(q_vec, tfidf_mat)
 
-def inverse_doc_freq(vocab: list[str], doc_freq: dict[str, int],  n_docs: int):
-    '''
-    Calculates the inverse document frequency
-    '''
-    idf = {}
+    results = [(key, similarities[0][i]) for i, key in enumerate(docs)]
+    results.sort(key = lambda x: x[1], reverse = True)
+    return results
 
-    for word in vocab:
-        idf[word] = np.log2(n_docs / (doc_freq[word] + 1)) + 1
+# raw: f, log: 1 + ln f, augmented: 0.5 + 0.5 f / (largest f in the document), binary: 1
+TF_VARIANTS = ("raw", "log", "augmented", "binary")
 
-    return idf
+# smooth: ln((1 + N) / (1 + df)) + 1 as in sklearn, standard: ln(N / df) + 1,
+# probabilistic: max(0, ln((N - df) / df)), none: 1
+IDF_VARIANTS = ("smooth", "standard", "probabilistic", "none")
 
-def tfidf(docs: dict[str, str]):
+def _per_row(ufunc, data: np.ndarray, indptr: np.ndarray) -> np.ndarray:
     '''
-    Calculates the TF-IDF for a given set of documents
+    `ufunc` reduced over every CSR row, 0 for empty rows
     '''
-    preprocessed_docs = doc_processor(docs)
-
-    vocab = build_vocab(preprocessed_docs)
+    result = np.zeros(len(indptr) - 1)
+    nonempty = np.diff(indptr) > 0
+    if nonempty.any():
+        result[nonempty] = ufunc.reduceat(data, indptr[:-1][nonempty])
+    return result
 
-    t_freq = term_freq(vocab, preprocessed_docs)
-    d_freq = word_freq(vocab, preprocessed_docs)
-    idf_scr = inverse_doc_freq(vocab, d_freq, len(preprocessed_docs.keys()))
+def idf_weights(doc_freqs: np.ndarray, n_docs: int, idf: str = "smooth") -> np.ndarray:
+    '''
+    Inverse document frequency of every term for one of the `IDF_VARIANTS`
+    '''
+    if idf not in IDF_VARIANTS:
+        raise ValueError(f"Unknown idf '{idf}', expected one of {', '.join(IDF_VARIANTS)}")
+
+    df = np.maximum(np.asarray(doc_freqs, dtype=np.float64), 1)
+    if idf == "smooth":
+        return np.log((1 + n_docs) / (1 + df)) + 1
+    if idf == "standard":
+        return np.log(n_docs / df) + 1
+    if idf == "probabilistic":
+        return np.maximum(np.log(np.maximum(n_docs - df, 1) / df), 0)
+    return np.ones(len(df))
+
+class TfidfWeighting:
+    '''
+    The term weighting of a fitted TF-IDF matrix, reapplied to queries.
 
-    tf_idf_score = {}
+    Stands in for the parts of sklearn's `TfidfVectorizer` the models use:
+    `vocabulary_` (term -> column), `idf_`, and `transform` over
+    preprocessed, space-joined text. Text is split on whitespace only, so
+    queries are weighted over exactly the tokens the index holds.
+    '''
+    def __init__(self, vocabulary, idf: np.ndarray, tf: str = "raw", norm: str = "l2"):
+        if tf not in TF_VARIANTS:
+            raise ValueError(f"Unknown tf '{tf}', expected one of {', '.join(TF_VARIANTS)}")
+        self.vocabulary_ = vocabulary
+        self.idf_ = np.asarray(idf, dtype=np.float64)
+        self.tf = tf
+        self.norm = norm
+
+    def weigh(self, counts: csr_matrix) -> csr_matrix:
+        '''
+        TF-IDF weights of a document x term count matrix
+        '''
+        counts = counts.tocsr()
+        data = counts.data.astype(np.float64)
+        row_sizes = np.diff(counts.indptr)
+
+        if self.tf == "log":
+            data = 1 + np.log(data)
+        elif self.tf == "augmented":
+            data = 0.5 + 0.5 * data / np.repeat(_per_row(np.maximum, data, counts.indptr), row_sizes)
+        elif self.tf == "binary":
+            data = np.ones_like(data)
+
+        data *= self.idf_[counts.indices]
+
+        if self.norm == "l2":
+            norms = np.sqrt(_per_row(np.add, data * data, counts.indptr))
+            data /= np.repeat(np.where(norms > 0, norms, 1), row_sizes)
+
+        return csr_matrix((data, counts.indices, counts.indptr), shape=counts.shape)
+
+    def transform(self, docs: list[str]) -> csr_matrix:
+        columns, counts, indptr = [], [], [0]
+        for doc in docs:
+            terms = Counter(self.vocabulary_.get(term) for term in doc.split())
+            terms.pop(None, None)
+            columns.extend(terms)
+            counts.extend(terms.values())
+            indptr.append(len(columns))
+
+        counts = csr_matrix((np.array(counts, dtype=np.float64), np.array(columns, dtype=np.int32),
+                             np.array(indptr, dtype=np.int64)), shape=(len(docs), len(self.idf_)))
+        counts.sort_indices()
+        return self.weigh(counts)
+
+def index_tfidf(index: InvertedIndex, tf: str = "raw", idf: str = "smooth", norm: str = "l2"):
+    '''
+    TF-IDF matrix (documents x terms, CSR) and its weighting, read straight
+    from the postings of an inverted index: the postings already are the
+    term-major count matrix, so nothing is tokenized or counted again.
+    Rows follow `index.doc_names` and columns `index.term_names`.
+    '''
+    docs, freqs = index.flat_postings()
+    counts = csc_matrix((freqs, docs, index.offsets), shape=(index.num_docs, len(index))).tocsr()
+    counts.sort_indices()
 
-    for doc_id in docs.keys():
-        tf_idf_score[doc_id] = {}
+    weighting = TfidfWeighting(index.terms, idf_weights(index.doc_freqs, index.num_docs, idf), tf, norm)
+    return weighting.weigh(counts), weighting
 
-    for word in vocab:
-        for doc_id, _ in docs.items():
-            tf_idf_score[doc_id][word] = t_freq[doc_id][word] * idf_scr[word]
+def tfidf(docs: dict[str, str], processed_docs: dict[str, str] = None, tf: str = "raw",
+          idf: str = "smooth", norm: str = "l2"):
+    '''
+    Drop-in for `sklearn_tfidf` on the native engine, with selectable TF and IDF variants
+    '''
+    if processed_docs is None:
+        processed_docs = doc_processor(docs)
 
-    return tf_idf_score
+    index = InvertedIndex({doc: Counter(text.split()) for doc, text in processed_docs.items()})
+    return index_tfidf(index, tf, idf, norm)